@@ -1,18 +1,38 @@
 from loguru import logger
 from pathlib import Path
 from urllib.parse import urlparse
+from dataclasses import dataclass, field
+from contextlib import aclosing
 import click
+from typing import AsyncGenerator, Awaitable, Callable, Any
 import asyncio
+import functools
 import traceback
 
 from booru_tools import core
-from booru_tools.shared import resources, constants
+from booru_tools.shared import resources, constants, import_state
 from booru_tools.plugins import _plugin_template
+from booru_tools.downloaders import _base, media_cache as _media_cache
+
+@dataclass(kw_only=True)
+class UrlSyncState:
+    url:str
+    previous_newest_origin_id:int = field(default=None) # The newest origin id seen the last time this url was imported
+    newest_origin_id:int = field(default=None) # The newest origin id seen during this import
+    known_page_count:int = field(default=0) # The number of consecutive pages that only had already imported posts
+    finished:bool = field(default=False)
+
+    def update_newest_origin_id(self, origin_id:Any) -> None:
+        if not isinstance(origin_id, int):
+            return None
+        if self.newest_origin_id is None or origin_id > self.newest_origin_id:
+            self.newest_origin_id = origin_id
+        return None
 
 class ImportPostsCommand():
     def __init__(self):
-        self.blank_download_page_count = 0
         self.all_tags:list[resources.InternalTag] = []
+        self._seen_tag_names:set[str] = set()
     
     async def post_init(self, 
                 destination:str, 
@@ -27,7 +47,10 @@ class ImportPostsCommand():
                 plugin_override:str="", 
                 download_page_size:int=100,
                 allowed_safety:str="",
-                minimum_score:int=0
+                minimum_score:int=0,
+                pipeline_queue_size:int=2,
+                concurrent_urls:int=1,
+                use_import_state:bool=True
             ):
         
         self.booru_tools = core.BooruTools()
@@ -54,33 +77,123 @@ class ImportPostsCommand():
         # Maybe expand this out to get tags from the destination plugin and populate aliases. Extra toggle maybe?
         self.blacklisted_tags = self.booru_tools.split_tag_list(blacklisted_tags)
         self.required_tags = self.booru_tools.split_tag_list(required_tags)
-        self.allowed_blank_pages = allowed_blank_pages
+        self.allowed_blank_pages = max(allowed_blank_pages, 1)
         self.download_page_size = download_page_size
         self.minimum_score = minimum_score
+        self.pipeline_queue_size = pipeline_queue_size
+        self.concurrent_urls = max(concurrent_urls, 1)
+
+        self.import_state:import_state.ImportStateDatabase = None
+        if use_import_state:
+            destination_plugin = self.booru_tools.destination_plugin
+            self.import_state = import_state.ImportStateDatabase(
+                database_file=self.booru_tools.config["core"]["import_state_file"],
+                destination=destination_plugin.URL_BASE or destination_plugin._NAME
+            )
 
     async def run(self, *args, **kwargs):
         await self.post_init(*args, **kwargs)
-        processed_posts = []
-
-        for url in self.urls:
-            async for job in self.download_posts_from_url(url):
-                posts = [item.resource for item in job.download_items if item.ignore == False]
-                try:
-                    processed_posts.extend([post.id for post in posts])
-                    await self.booru_tools.update_posts(posts=posts)
-                except Exception as e:
-                    logger.critical(f"url import failed with {e}")
-                    logger.critical(traceback.format_exc())
-                finally:
-                    job.cleanup_folders()
+
+        url_semaphore = asyncio.Semaphore(self.concurrent_urls)
+        async with asyncio.TaskGroup() as task_group:
+            for url in self.urls:
+                task_group.create_task(self._import_posts_from_url_limited(url=url, semaphore=url_semaphore))
 
         # filtered_tags = self._filter_tags(tags=self.all_tags)
         # await self.booru_tools.update_tags(tags=filtered_tags)
         # self.all_tags = []
         
+        if self.import_state:
+            self.import_state.close()
+        if media_cache := _media_cache.get_media_cache():
+            media_cache.close()
         self.booru_tools.cleanup_process_directories()
         await self.booru_tools.session_manager.close()
+
+    async def import_posts_from_url(self, url:str) -> None:
+        """Imports all posts from the url through a staged pipeline
+
+        Each stage works on one job at a time and hands it to the next stage through a bounded queue,
+        so the next page is being fetched and downloaded while the current page is being uploaded.
+
+        Args:
+            url (str): The url to import posts from
+        """
+        existence_queue:asyncio.Queue[_base.DownloadJob|None] = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        download_queue:asyncio.Queue[_base.DownloadJob|None] = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        hash_queue:asyncio.Queue[_base.DownloadJob|None] = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        upload_queue:asyncio.Queue[_base.DownloadJob|None] = asyncio.Queue(maxsize=self.pipeline_queue_size)
+
+        sync_state = UrlSyncState(url=url)
+        if self.import_state:
+            sync_state.previous_newest_origin_id = self.import_state.get_newest_origin_id(url=url)
+
+        check_job_for_existing_posts = functools.partial(self._check_job_for_existing_posts, sync_state=sync_state)
+
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(self._metadata_stage(url=url, output_queue=existence_queue, sync_state=sync_state))
+            task_group.create_task(self._pipeline_stage(func=check_job_for_existing_posts, input_queue=existence_queue, output_queue=download_queue))
+            task_group.create_task(self._pipeline_stage(func=self._download_job_media, input_queue=download_queue, output_queue=hash_queue))
+            task_group.create_task(self._pipeline_stage(func=self._hash_job_media, input_queue=hash_queue, output_queue=upload_queue))
+            task_group.create_task(self._upload_stage(input_queue=upload_queue))
+
+        if self.import_state and sync_state.newest_origin_id is not None:
+            if sync_state.previous_newest_origin_id is None or sync_state.newest_origin_id > sync_state.previous_newest_origin_id:
+                logger.debug(f"Saving newest origin id {sync_state.newest_origin_id} for '{url}'")
+                self.import_state.save_newest_origin_id(url=url, newest_origin_id=sync_state.newest_origin_id)
+
+    async def _import_posts_from_url_limited(self, url:str, semaphore:asyncio.Semaphore) -> None:
+        async with semaphore:
+            await self.import_posts_from_url(url)
+
+    async def _metadata_stage(self, url:str, output_queue:asyncio.Queue, sync_state:UrlSyncState) -> None:
+        async with aclosing(self.download_posts_from_url(url)) as jobs:
+            async for job in jobs:
+                if sync_state.finished:
+                    job.cleanup_folders()
+                    break
+                for item in job.download_items:
+                    sync_state.update_newest_origin_id(origin_id=item.resource.id)
+                await output_queue.put(job)
+        # The end of stream marker is only sent on a normal finish, when a stage fails the task group cancels the rest
+        await output_queue.put(None)
+
+    async def _pipeline_stage(self, func:Callable[[_base.DownloadJob], Awaitable[_base.DownloadJob]], input_queue:asyncio.Queue, output_queue:asyncio.Queue) -> None:
+        while (job := await input_queue.get()) is not None:
+            try:
+                job = await func(job)
+            except Exception as e:
+                logger.critical(f"url import job failed in {func.__name__} with {e}")
+                logger.critical(traceback.format_exc())
+                job.cleanup_folders()
+                continue
+            await output_queue.put(job)
+        await output_queue.put(None)
+
+    async def _upload_stage(self, input_queue:asyncio.Queue) -> None:
+        while (job := await input_queue.get()) is not None:
+            posts = [item.resource for item in job.download_items if item.ignore == False]
+            exact_posts = {item.resource.id: item.existing_post for item in job.download_items if item.ignore == False and item.existing_post_checked}
+            try:
+                pushed_posts = await self.booru_tools.update_posts(posts=posts, add_hashes=False, exact_posts=exact_posts)
+                self._save_import_state(posts=posts, pushed_posts=pushed_posts)
+            except Exception as e:
+                logger.critical(f"url import failed with {e}")
+                logger.critical(traceback.format_exc())
+            finally:
+                job.cleanup_folders()
     
+    def _save_import_state(self, posts:list[resources.InternalPost], pushed_posts:list[resources.InternalPost|None]) -> None:
+        if not self.import_state:
+            return None
+        
+        for post, pushed_post in zip(posts, pushed_posts):
+            if not pushed_post:
+                continue
+            self.import_state.save_post_state(post=post, destination_post=pushed_post)
+        self.import_state.commit()
+        return None
+
     def _filter_tags(self, tags:list[resources.InternalTag]) -> list[resources.InternalTag]:
         filtered_tags = [tag for tag in tags if tag.category != constants.TagCategory._DEFAULT]
         logger.debug(f"Filtered out tags in default category, going from {len(tags)} tags to {len(filtered_tags)} tags")
@@ -92,22 +205,24 @@ class ImportPostsCommand():
             return False
         return True
 
-    async def download_posts_from_url(self, url:str):
+    async def download_posts_from_url(self, url:str) -> AsyncGenerator[_base.DownloadJob, None]:
         domain:str = urlparse(url).hostname
 
         meta_plugin:_plugin_template.MetadataPlugin = self.booru_tools.metadata_loader.load_matching_plugin(domain=domain)
         api_plugin:_plugin_template.ApiPlugin = self.booru_tools.api_loader.load_matching_plugin(domain=domain)
         validator_plugins:list[_plugin_template.ValidationPlugin] = self.booru_tools.validation_loader.load_all_plugins()
 
-        for job in meta_plugin.DOWNLOAD_MANAGER.download(url=url):
+        async for job in meta_plugin.DOWNLOAD_MANAGER.download_async(url=url):
             for item in job.download_items:
                 plugins = resources.InternalPlugins(
                     api=api_plugin,
                     meta=meta_plugin,
                     validators=validator_plugins
                 )
-                metadata_file = item.metadata_file
-                post = meta_plugin._from_metadata_file(metadata_file=metadata_file, plugins=plugins)
+                if item.metadata_file:
+                    post = meta_plugin._from_metadata_file(metadata_file=item.metadata_file, plugins=plugins)
+                else:
+                    post = meta_plugin._from_metadata(data=item.metadata, plugins=plugins)
 
                 item.resource = post
 
@@ -117,35 +232,106 @@ class ImportPostsCommand():
                     continue
 
                 for tag in post.tags:
-                    if tag in self.all_tags:
+                    # A tag sharing any name with one already seen is the same tag under an alias
+                    if not self._seen_tag_names.isdisjoint(tag.names):
                         continue
+                    self._seen_tag_names.update(tag.names)
                     self.all_tags.append(tag)
+
+            yield job
+
+    async def _check_job_for_existing_posts(self, job:_base.DownloadJob, sync_state:UrlSyncState=None) -> _base.DownloadJob:
+        job = self._check_job_import_state(job=job)
+        if sync_state:
+            self._update_sync_state(job=job, sync_state=sync_state)
+
+        # Previously imported posts are checked too, as their destination post may have been deleted since
+        posts = [item.resource for item in job.download_items if item.ignore == False]
+        existing_posts = await self.booru_tools.find_exact_posts(posts=posts)
+        
+        for item in job.download_items:
+            if item.ignore:
+                continue
+
+            item.existing_post_checked = True
+            item.existing_post = existing_posts[item.resource.id]
+            if item.existing_post:
+                continue
+            if item.previously_imported:
+                logger.info(f"Post '{item.resource.id}' was previously imported but wasn't found on the destination, downloading it again")
+            item.media_download_desired = True
+        return job
+
+    def _check_job_import_state(self, job:_base.DownloadJob) -> _base.DownloadJob:
+        if not self.import_state:
+            return job
+        
+        for item in job.download_items:
+            if item.ignore:
+                continue
+
+            post:resources.InternalPost = item.resource
+            post_state = self.import_state.get_post_state(post=post)
+            if not post_state:
+                continue
+
+            if post_state.matches(post=post):
+                logger.info(f"Skipping '{post.id}' as it is unchanged since it was imported as '{post_state.destination_id}'")
+                item.ignore = True
+                item.unchanged = True
+                continue
             
-            posts = [item.resource for item in job.download_items if item.ignore == False]
-            existing_post_tasks = await self._check_for_existing_posts(posts=posts)
-            
-            for item in job.download_items:
-                if item.ignore:
-                    continue
+            logger.debug(f"Post '{post.id}' was previously imported as '{post_state.destination_id}', using its stored hashes to find it")
+            item.previously_imported = True
+            post.md5 = post.md5 or post_state.md5
+            post.sha1 = post.sha1 or post_state.sha1
+        return job
 
-                existing_post:resources.InternalPost = existing_post_tasks[item.resource.id].result()
-                if existing_post:
-                    post:resources.InternalPost = existing_post.merge_resource(update_object=post, deep_copy=False)
-                else:
-                    item.media_download_desired = True
+    def _update_sync_state(self, job:_base.DownloadJob, sync_state:UrlSyncState) -> None:
+        """Counts consecutive pages that contain nothing new, marking the url as finished after 'allowed_blank_pages' of them
 
-            job.download_media()
-            yield job
+        A post counts as already known if it's unchanged since it was last imported,
+        or if it was filtered out and is no newer than the newest post seen in the last import of this url
 
-    async def _check_for_existing_posts(self, posts:list[resources.InternalPost]) -> dict[int, asyncio.Task]:
-        existing_posts:dict[int, asyncio.Task] = {}
-        async with asyncio.TaskGroup() as task_group:
-            for post in posts:
-                task = task = task_group.create_task(
-                    self.booru_tools.find_exact_post(post=post)
-                )
-                existing_posts[post.id] = task
-        return existing_posts
+        Args:
+            job (_base.DownloadJob): The job for the current page
+            sync_state (UrlSyncState): The sync state of the url the job is from
+        """
+        if not self.import_state or not job.download_items:
+            return None
+        
+        for item in job.download_items:
+            if item.unchanged:
+                continue
+            if item.ignore and self._is_older_than_previous_import(post=item.resource, sync_state=sync_state):
+                continue
+            sync_state.known_page_count = 0
+            return None
+        
+        sync_state.known_page_count += 1
+        logger.debug(f"Page {sync_state.known_page_count}/{self.allowed_blank_pages} with no new posts found for '{sync_state.url}'")
+        if sync_state.known_page_count >= self.allowed_blank_pages:
+            logger.info(f"Stopping import of '{sync_state.url}' as the last {sync_state.known_page_count} page(s) had no new posts")
+            sync_state.finished = True
+        return None
+
+    @staticmethod
+    def _is_older_than_previous_import(post:resources.InternalPost, sync_state:UrlSyncState) -> bool:
+        if sync_state.previous_newest_origin_id is None:
+            return False
+        if not isinstance(post.id, int):
+            return False
+        return post.id <= sync_state.previous_newest_origin_id
+
+    async def _download_job_media(self, job:_base.DownloadJob) -> _base.DownloadJob:
+        await job.download_media_async(session=self.booru_tools.session_manager.session)
+        return job
+
+    async def _hash_job_media(self, job:_base.DownloadJob) -> _base.DownloadJob:
+        posts = [item.resource for item in job.download_items if item.ignore == False and not (item.md5 and item.sha1)]
+        await self.booru_tools.add_missing_post_hashes_async(posts=posts)
+        job.cache_media()
+        return job
 
 @click.command()
 @click.option('--url', multiple=True, help='URL to import from')
@@ -157,10 +343,13 @@ class ImportPostsCommand():
 @click.option('--required-tags', type=str, default="", help="A comma seperated list of tags to require on all posts, you can specify an AND condition with |")
 @click.option('--minimum-score', type=int, default=0, help="The minimum score a post must have to be imported")
 @click.option('--match-source/--ignore-source', default=True, help="Whether post source should be used when importing")
-@click.option('--allowed-blank-pages', type=int, default=1, help="Number of pages to download post pages before stopping")
+@click.option('--allowed-blank-pages', type=int, default=1, help="Number of consecutive pages with no new or changed posts to allow before stopping")
 @click.option('--plugin-override', type=str, help="Provide plugin override values")
 @click.option('--download-page-size', type=int, default=100, help="The number of posts to download per page")
 @click.option('--allowed-safety', type=str, default="", help=f"The comma seperated list of allowed safety ratings from [{constants.Safety.SAFE},{constants.Safety.SKETCHY},{constants.Safety.UNSAFE}]")
+@click.option('--pipeline-queue-size', type=int, default=2, help="The number of pages each import stage can hold while waiting on the next stage")
+@click.option('--concurrent-urls', type=int, default=1, help="The number of urls to import from at the same time")
+@click.option('--use-import-state/--ignore-import-state', default=True, help="Whether to skip posts that are unchanged since they were last imported")
 # Need to add something to require specific ratings as these aren't generally
 def cli(*args, **kwargs):
     command = ImportPostsCommand()
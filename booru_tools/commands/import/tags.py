@@ -12,7 +12,9 @@ class ImportTagsCommand():
             only_related_tags:bool=False,
             import_site:str="",
             destination:str="",
-            plugin_override:str=""
+            plugin_override:str="",
+            plan_changes:bool=False,
+            dry_run:bool=False
         ):
         booru_config = {
             "destination": destination
@@ -35,6 +37,8 @@ class ImportTagsCommand():
                     self.found_import_plugins.append(site_plugin)
         
         self.only_import_related_tags = only_related_tags
+        self.plan_changes = plan_changes or dry_run
+        self.dry_run = dry_run
 
     async def run(self, *args, **kwargs):
         await self.post_init(*args, **kwargs)
@@ -52,7 +56,11 @@ class ImportTagsCommand():
             await self._import_tags(tags=all_site_tags)
 
     async def _import_tags(self, tags:list[resources.InternalTag]):
-        if not self.only_import_related_tags:
+        if self.only_import_related_tags:
+            return None
+        if self.plan_changes:
+            await self.booru_tools.sync_tags(tags=tags, dry_run=self.dry_run)
+        else:
             await self.booru_tools.update_tags(tags=tags)
 
 @click.command()
@@ -60,6 +68,8 @@ class ImportTagsCommand():
 @click.option('--import-site', multiple=True, help='The site name or domain to import from')
 @click.option('--destination', default="szurubooru", help='Where to send the new tags to')
 @click.option('--plugin-override', type=str, help="Provide plugin override values")
+@click.option('--plan-changes', is_flag=True, help="Diff the tags against all of the destination's tags first, and only push the tags that changed")
+@click.option('--dry-run', is_flag=True, help="Only log the planned tag changes without pushing them")
 def cli(*args, **kwargs):
     command = ImportTagsCommand()
     asyncio.run(command.run(*args, **kwargs))
\ No newline at end of file
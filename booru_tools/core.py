@@ -2,6 +2,7 @@ from pathlib import Path
 from urllib.parse import urlparse
 from loguru import logger
 from collections import defaultdict
+from typing import Callable, Awaitable, Any
 from http.cookiejar import MozillaCookieJar
 import json
 import shutil
@@ -9,10 +10,14 @@ import hashlib
 import asyncio
 import aiohttp
 import signal
+import functools
+import dataclasses
 
 from booru_tools.loaders import plugin_loader
 from booru_tools.plugins import _plugin_template
-from booru_tools.shared import errors, resources, constants, config
+from booru_tools.shared import errors, resources, constants, config, tag_sync, post_filter
+
+HASH_BUFFER_SIZE = 1024 * 1024
 
 class GracefulExit(SystemExit):
     code = 1
@@ -84,6 +89,7 @@ class BooruTools:
         
         self.config = config.ConfigManager()
         self.tmp_directory = constants.TEMP_FOLDER
+        self._post_filter:post_filter.PostFilter = None
         self.session_manager = SessionManager(
             limit_per_host=self.config["networking"].get("limit_per_host", 20)
         )
@@ -154,8 +160,63 @@ class BooruTools:
         exact_post = await self.destination_plugin.find_exact_post(post=post)
         return exact_post
 
-    async def update_posts(self, posts:list[resources.InternalPost]):
+    async def find_exact_posts(self, posts:list[resources.InternalPost]) -> dict[int, resources.InternalPost|None]:
+        """Finds the existing destination post for each post, resolving hashes in bulk where the destination supports it
+
+        Args:
+            posts (list[resources.InternalPost]): The posts to find
+
+        Returns:
+            dict[int, resources.InternalPost|None]: The existing post, or None, keyed by the id of each provided post
+        """
+        logger.info(f"Getting exact posts for {len(posts)} posts")
+
+        for post in posts:
+            if post.post_url and post.post_url not in post.sources:
+                logger.debug(f"Adding post url '{post.post_url}' to sources for '{post.id}'")
+                post.sources.append(post.post_url)
+
+        try:
+            hash_matches = await self.destination_plugin.find_exact_posts(posts=posts)
+            check_hashes = False
+        except NotImplementedError:
+            logger.debug(f"Bulk post search not supported by {self.destination_plugin._NAME}, searching each post")
+            hash_matches = {}
+            check_hashes = True
+
+        exact_posts:dict[int, resources.InternalPost|None] = {}
+        tasks:dict[int, asyncio.Task] = {}
+        async with asyncio.TaskGroup() as task_group:
+            for post in posts:
+                exact_post = hash_matches.get(post.md5) or hash_matches.get(post.sha1)
+                if exact_post:
+                    exact_posts[post.id] = exact_post
+                    continue
+                tasks[post.id] = task_group.create_task(
+                    self.destination_plugin.find_exact_post(post=post, check_hashes=check_hashes)
+                )
+        
+        for post_id, task in tasks.items():
+            exact_posts[post_id] = task.result()
+        return exact_posts
+
+    async def update_posts(self, posts:list[resources.InternalPost], add_hashes:bool=True, exact_posts:dict[int, resources.InternalPost|None]=None) -> list[resources.InternalPost|None]:
+        """Pushes each post to the destination
+
+        Args:
+            posts (list[resources.InternalPost]): The posts to push
+            add_hashes (bool, optional): Whether to hash the local files of posts missing their hashes first. Defaults to True.
+            exact_posts (dict[int, resources.InternalPost|None], optional): Existing destination posts that were already resolved
+                with find_exact_posts, keyed by post id. Posts in here aren't searched for again. Defaults to None.
+
+        Returns:
+            list[resources.InternalPost|None]: The pushed post for each post, in the same order
+        """
         logger.info(f"Updating {len(posts)} posts")
+        exact_posts = exact_posts or {}
+
+        if add_hashes:
+            posts = await self.add_missing_post_hashes_async(posts=posts)
 
         tasks:list[asyncio.Task] = []
         async with asyncio.TaskGroup() as task_group:
@@ -164,7 +225,6 @@ class BooruTools:
                     logger.debug(f"No file to upload for '{post.id}'")
                 else:
                     logger.debug(f"File '{post.local_file.name}' found for '{post.id}'")
-                    post = self.add_missing_post_hashes(post=post)
 
                 if post.post_url:
                     if post.post_url not in post.sources:
@@ -172,53 +232,191 @@ class BooruTools:
                         post.sources.append(post.post_url)
 
                 logger.debug(f"Updating post '{post.id}'")
-                task = task_group.create_task(
-                    self.destination_plugin.push_post(post=post)
-                )
+                if post.id in exact_posts:
+                    push = self.destination_plugin.push_post(post=post, exact_post=exact_posts[post.id], check_exact_post=False)
+                else:
+                    push = self.destination_plugin.push_post(post=post)
+                task = task_group.create_task(push)
                 tasks.append(task)
         results = [task.result() for task in tasks]
+        return results
+
+    @property
+    def post_filter(self) -> post_filter.PostFilter:
+        # Compiled on first use from the core config, call reset_post_filter after changing the config
+        if not self._post_filter:
+            self._post_filter = post_filter.PostFilter(
+                blacklisted_tags=self.config["core"]["blacklisted_tags"],
+                required_tags=self.config["core"]["required_tags"],
+                allowed_safety=self.config["core"]["allowed_safety"],
+                minimum_score=self.config["core"]["minimum_score"]
+            )
+        return self._post_filter
+
+    def reset_post_filter(self) -> None:
+        self._post_filter = None
+        return None
 
     def check_post_allowed(self, post:resources.InternalPost):
-        blacklisted_tags = self.config["core"]["blacklisted_tags"]
-        if post.contains_any_tags(tags=blacklisted_tags):
-            logger.debug(f"Post '{post.id}' contains blacklisted tags from {blacklisted_tags}")
-            return False
-        required_tags = self.config["core"]["required_tags"]
-        if not post.contains_all_tags(tags=required_tags):
-            logger.debug(f"Post '{post.id}' does not contain all required tags from {required_tags}")
-            return False
-        allowed_safety = self.config["core"]["allowed_safety"]
-        if allowed_safety and (post.safety not in allowed_safety):
-            logger.debug(f"Post '{post.id}' with '{post.safety}' is not in the allowed safety selection from {allowed_safety}")
-            return False
-        minimum_score = self.config["core"]["minimum_score"]
-        if minimum_score and post.score < minimum_score:
-            logger.debug(f"Post '{post.id}' has a score of {post.score} which is below the minimum score of {minimum_score}")
-            return False
-        if post.deleted:
-            logger.debug(f"Post '{post.id}' is marked as deleted")
+        if not self.post_filter.is_allowed(post=post):
+            logger.debug(f"Post '{post.id}' {self.post_filter.get_rejection_reason(post=post)}")
             return False
         logger.debug(f"Post '{post.id}' passed all checks")
         return True
 
-    async def update_tags(self, tags:list[resources.InternalTag]):
+    def filter_allowed_posts(self, posts:list[resources.InternalPost]) -> list[resources.InternalPost]:
+        """Filters a batch of posts down to the ones allowed by the core config
+
+        Args:
+            posts (list[resources.InternalPost]): The posts to filter
+
+        Returns:
+            list[resources.InternalPost]: The allowed posts
+        """
+        return self.post_filter.filter_posts(posts=posts)
+
+    async def update_tags(self, tags:list[resources.InternalTag], concurrency:int=500):
+        """Pushes the tags in layers ordered by their implications, so every implied tag exists before the tags implying it
+
+        Tags breaking an implication cycle are first pushed without the implications that aren't pushed yet, then pushed again in full at the end
+
+        Args:
+            tags (list[resources.InternalTag]): The tags to push
+            concurrency (int, optional): The number of tags to push at once within a layer. Defaults to 500.
+        """
         logger.info(f"Updating {len(tags)} tags")
-        chunk_count = 0
-        chunk_size = 500
-        total_tags = len(tags)
-        for tags_chunk in self.divide_chunks(tags, chunk_size):
-            chunk_count += 1
-            completion_percent = int(((chunk_count * chunk_size) / total_tags) * 100)
-            logger.info(f"Processing chunk {chunk_count} ({len(tags_chunk)}/{chunk_size}) of {total_tags} tags ({completion_percent}%)")
-            tasks:list[asyncio.Task] = []
-            async with asyncio.TaskGroup() as task_group:
-                for tag in tags_chunk:
-                    task = task_group.create_task(
-                        self.destination_plugin.push_tag(tag=tag)
+        layers, cycle_breaks = tag_sync.get_implication_layers(tags=tags)
+        cycle_break_indexes = set(cycle_breaks)
+        all_names = {name.lower() for tag in tags for name in tag.names}
+        pushed_names:set[str] = set()
+        pushed_count = 0
+
+        for layer_count, layer in enumerate(layers, start=1):
+            completion_percent = int((pushed_count / len(tags)) * 100)
+            logger.info(f"Processing implication layer {layer_count} of {len(layers)} with {len(layer)} tags ({completion_percent}%)")
+
+            layer_tags:list[resources.InternalTag] = []
+            for index in layer:
+                tag = tags[index]
+                if index in cycle_break_indexes:
+                    tag = dataclasses.replace(
+                        tag,
+                        implications=[
+                            implication for implication in tag.implications
+                            if not any(name.lower() in all_names and name.lower() not in pushed_names for name in implication.names)
+                        ]
                     )
-                    tasks.append(task)
-            results = [task.result() for task in tasks]
-    
+                layer_tags.append(tag)
+
+            await self._run_concurrently(items=layer_tags, func=self._push_tag, concurrency=concurrency)
+
+            for tag in layer_tags:
+                pushed_names.update(name.lower() for name in tag.names)
+            pushed_count += len(layer_tags)
+
+        if cycle_breaks:
+            logger.info(f"Pushing {len(cycle_breaks)} tags that broke implication cycles with their full implications")
+            cycle_break_tags = [tags[index] for index in cycle_breaks]
+            await self._run_concurrently(items=cycle_break_tags, func=self._push_tag, concurrency=concurrency)
+
+    async def _push_tag(self, tag:resources.InternalTag) -> resources.InternalTag:
+        return await self.destination_plugin.push_tag(tag=tag)
+
+    @staticmethod
+    async def _run_concurrently(items:list, func:Callable[[Any], Awaitable[Any]], concurrency:int=500) -> None:
+        """Runs the function on every item, with up to 'concurrency' items in flight at once
+
+        Args:
+            items (list): The items to run the function on
+            func (Callable[[Any], Awaitable[Any]]): The async function to run on each item
+            concurrency (int, optional): The maximum number of items in flight. Defaults to 500.
+        """
+        item_iterator = iter(items)
+
+        async def worker():
+            for item in item_iterator:
+                await func(item)
+
+        async with asyncio.TaskGroup() as task_group:
+            for _ in range(min(concurrency, len(items))):
+                task_group.create_task(worker())
+
+    async def sync_tags(self, tags:list[resources.InternalTag], dry_run:bool=False) -> tag_sync.TagSyncPlan:
+        """Plans the tag operations against a snapshot of the destination's tags, then only runs the planned operations
+
+        Falls back to update_tags when the destination can't provide a snapshot of all its tags
+
+        Args:
+            tags (list[resources.InternalTag]): The full source tag graph
+            dry_run (bool, optional): Only log the plan without running it. Defaults to False.
+
+        Returns:
+            tag_sync.TagSyncPlan: The plan that was run
+        """
+        try:
+            destination_tags = await self.destination_plugin.get_all_tags()
+        except NotImplementedError:
+            logger.warning(f"Plugin {self.destination_plugin._NAME} can't provide all of its tags, updating every tag instead")
+            await self.update_tags(tags=tags)
+            return None
+
+        logger.info(f"Planning tag changes from {len(tags)} source tags against {len(destination_tags)} destination tags")
+        planner = tag_sync.TagSyncPlanner(
+            destination_tags=destination_tags,
+            destination=self.destination_plugin._NAME
+        )
+        plan = planner.plan(tags=tags)
+
+        if dry_run:
+            for step in plan.steps:
+                for operation in step.operations:
+                    logger.info(f"Planned to {operation}")
+            return plan
+
+        layers, _ = tag_sync.get_implication_layers(tags=[step.source_tag for step in plan.steps])
+        for layer_count, layer in enumerate(layers, start=1):
+            logger.info(f"Processing implication layer {layer_count} of {len(layers)} with {len(layer)} planned tag steps")
+            await self._run_concurrently(
+                items=[plan.steps[index] for index in layer],
+                func=self._run_tag_sync_step
+            )
+
+        if plan.live_tags:
+            logger.info(f"Pushing {len(plan.live_tags)} tags that overlap planned steps")
+            await self.update_tags(tags=plan.live_tags)
+
+        return plan
+
+    async def _run_tag_sync_step(self, step:tag_sync.TagSyncStep) -> None:
+        """Runs the operations of a step in order, pushing the source tag with live conflict checks if any of them fail
+
+        Args:
+            step (tag_sync.TagSyncStep): The step to run
+        """
+        target_tag:resources.InternalTag = None
+        try:
+            for operation in step.operations:
+                logger.debug(f"Running planned operation to {operation}")
+                match operation.action:
+                    case "create":
+                        await self.destination_plugin.create_tag(tag=operation.tag)
+                    case "delete":
+                        await self.destination_plugin.delete_tag(tag=operation.tag)
+                    case "merge":
+                        target_tag = await self.destination_plugin.merge_tag(
+                            from_tag=operation.tag,
+                            to_tag=target_tag or operation.target
+                        )
+                    case "update":
+                        if target_tag:
+                            # The merge changed the version of the tag being updated
+                            operation.tag._extra.update(target_tag._extra)
+                        await self.destination_plugin.update_tag(tag=operation.tag)
+        except Exception as e:
+            logger.warning(f"Planned operations for tag '{step.source_tag}' failed with '{e}', pushing it with live conflict checks")
+            await self.destination_plugin.push_tag(tag=step.source_tag)
+        return None
+
     def cleanup_process_directories(self) -> None:
         """Cleans up the temporary directories
         """
@@ -240,8 +438,7 @@ class BooruTools:
         shutil.rmtree(directory)
     
     def add_missing_post_hashes(self, post:resources.InternalPost) -> resources.InternalPost:
-        file_md5 = self.get_md5_hash(file_path=post.local_file)
-        file_sha1 = self.get_sha1_hash(file_path=post.local_file)
+        file_md5, file_sha1 = self.get_file_hashes(file_path=post.local_file)
 
         if post.md5 != file_md5:
             if post.md5:
@@ -256,34 +453,73 @@ class BooruTools:
         
         return post
 
-    @staticmethod
-    def get_md5_hash(file_path:Path) -> str:
+    async def add_missing_post_hashes_async(self, posts:list[resources.InternalPost]) -> list[resources.InternalPost]:
+        """Hashes the local files of the posts in worker threads, so the event loop isn't blocked while large files are read
+
+        Args:
+            posts (list[resources.InternalPost]): The posts to add hashes to, posts without a local file are skipped
+
+        Returns:
+            list[resources.InternalPost]: The provided posts
+        """
+        async with asyncio.TaskGroup() as task_group:
+            for post in posts:
+                if not post.local_file:
+                    continue
+                task_group.create_task(
+                    asyncio.to_thread(self.add_missing_post_hashes, post=post)
+                )
+        return posts
+
+    @classmethod
+    def get_file_hashes(cls, file_path:Path) -> tuple[str, str]:
+        """Gets the md5 and sha1 hashes of a file from a single read of it
+
+        Hashes are cached on the path, size and modification time of the file, so retries don't re-read it
+
+        Args:
+            file_path (Path): The file to hash
+
+        Returns:
+            tuple[str, str]: The md5 and sha1 hashes, these are blank if the file doesn't exist
+        """
         if not file_path.exists():
-            return ""
+            return "", ""
         
-        logger.debug(f"Calculating md5 hash for '{file_path}'")
-        with open(file_path, "rb") as file:
-            file_hash = hashlib.md5()
-            while chunk := file.read(8192):
-                file_hash.update(chunk)
-
-        md5_hash = file_hash.hexdigest()
-        logger.debug(f"MD5 hash for '{file_path}' is '{md5_hash}'")
-        return md5_hash
+        file_stat = file_path.stat()
+        return cls._get_file_hashes(
+            file_path=file_path.absolute(),
+            file_size=file_stat.st_size,
+            file_mtime=file_stat.st_mtime_ns
+        )
 
     @staticmethod
-    def get_sha1_hash(file_path:Path) -> str:
-        if not file_path.exists():
-            return ""
-        
-        logger.debug(f"Calculating sha1 hash for '{file_path}'")
-        with open(file_path, "rb") as file:
-            file_hash = hashlib.sha1()
-            while chunk := file.read(8192):
-                file_hash.update(chunk)
-
-        sha1_hash = file_hash.hexdigest()
-        logger.debug(f"SHA1 hash for '{file_path}' is '{sha1_hash}'")
+    @functools.lru_cache(maxsize=4096)
+    def _get_file_hashes(file_path:Path, file_size:int, file_mtime:int) -> tuple[str, str]:
+        logger.debug(f"Calculating md5 and sha1 hashes for '{file_path}'")
+        md5_hash = hashlib.md5()
+        sha1_hash = hashlib.sha1()
+
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        buffer_view = memoryview(buffer)
+        with open(file_path, "rb", buffering=0) as file:
+            while read_size := file.readinto(buffer):
+                chunk = buffer_view[:read_size]
+                md5_hash.update(chunk)
+                sha1_hash.update(chunk)
+
+        file_hashes = (md5_hash.hexdigest(), sha1_hash.hexdigest())
+        logger.debug(f"MD5 and SHA1 hashes for '{file_path}' are {file_hashes}")
+        return file_hashes
+
+    @classmethod
+    def get_md5_hash(cls, file_path:Path) -> str:
+        md5_hash, sha1_hash = cls.get_file_hashes(file_path=file_path)
+        return md5_hash
+
+    @classmethod
+    def get_sha1_hash(cls, file_path:Path) -> str:
+        md5_hash, sha1_hash = cls.get_file_hashes(file_path=file_path)
         return sha1_hash
 
     @staticmethod
@@ -3,17 +3,32 @@ from __future__ import annotations
 from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime
-from typing import Generator, Optional, Any
+from typing import AsyncGenerator, Optional, Any
+from loguru import logger
+import aiohttp
+import asyncio
+import hashlib
 import shutil
 
-from booru_tools.shared import constants, resources
+from booru_tools.shared import constants, resources, errors
+from booru_tools.downloaders import media_cache as _media_cache
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 @dataclass(kw_only=True)
 class DownloadItem:
-    metadata_file:Path = field(compare=True)
+    metadata_file:Path = field(compare=True, default=None)
+    metadata:dict = field(repr=False, default=None)
+    media_url:str = field(default=None)
     media_file:Path = field(default=None)
     media_download_desired:bool = field(default=False)
     ignore:bool = field(default=False)
+    previously_imported:bool = field(default=False)
+    unchanged:bool = field(default=False)
+    existing_post_checked:bool = field(default=False)
+    existing_post:resources.InternalPost = field(repr=False, default=None) # The destination post found when existing_post_checked is set
+    md5:str = field(default="") # The md5 hash of the media file, when it was hashed while downloading
+    sha1:str = field(default="") # The sha1 hash of the media file, when it was hashed while downloading
     resource:resources.InternalPost = field(default=None)
     _download_override:Any = field(repr=False, default=None)
 
@@ -23,8 +38,12 @@ class DownloadJob:
     download_items:list[DownloadItem] = field(default_factory=list)
     _download_manager:DownloadManager = field(repr=False, default=None)
 
-    def download_media(self) -> None:
-        self._download_manager.download_pending_items(job=self)
+    async def download_media_async(self, session:aiohttp.ClientSession=None) -> None:
+        await self._download_manager.download_pending_items_async(job=self, session=session)
+        return None
+
+    def cache_media(self) -> None:
+        self._download_manager.cache_job_media(job=self)
         return None
     
     @property
@@ -37,20 +56,131 @@ class DownloadJob:
         return None
 
 class DownloadManager:
+    @property
+    def media_cache(self) -> _media_cache.MediaCache|None:
+        return _media_cache.get_media_cache()
+
     def create_temp_folder(self) -> Path:
         current_time = datetime.now()
         timestamp = str(current_time.timestamp())
         temp_folder = constants.TEMP_FOLDER / timestamp
         return temp_folder
 
-    def download_info(self, urls:list[str], download_directory:Path) -> list[DownloadItem]:
+    async def download_info_async(self, urls:list[str], download_directory:Path) -> list[DownloadItem]:
         raise NotImplementedError
 
-    def download_pending_items(self, job:DownloadJob) -> DownloadJob:
+    async def download_pending_items_async(self, job:DownloadJob, session:aiohttp.ClientSession=None) -> DownloadJob:
         raise NotImplementedError
 
-    def create_download_job(self, params:list) -> DownloadJob:
+    def link_cached_media(self, job:DownloadJob) -> DownloadJob:
+        """Hard links the media of any items already in the media cache into the job folder, so they aren't downloaded again
+
+        Args:
+            job (DownloadJob): The job with the items to find cached media for
+
+        Returns:
+            DownloadJob: The job with the media files and hashes set on the cached items
+        """
+        if not self.media_cache:
+            return job
+
+        for index, item in enumerate(job.download_items):
+            if not item.media_download_desired or item.ignore or item.media_file:
+                continue
+
+            cached_media = self.media_cache.get(md5=item.resource.md5, sha1=item.resource.sha1)
+            if not cached_media:
+                continue
+
+            if item.metadata_file:
+                media_file = item.metadata_file.parent / item.metadata_file.stem
+            else:
+                media_file = job.download_folder / f"{index}{cached_media.path.suffix}"
+
+            logger.debug(f"Using cached media '{cached_media.path}' for '{item.resource.id}'")
+            self.media_cache.link(cached_media=cached_media, destination=media_file)
+            item.media_file = media_file
+            item.md5 = cached_media.md5
+            item.sha1 = cached_media.sha1
+            item.resource.local_file = media_file
+            item.resource.md5 = cached_media.md5
+            if cached_media.sha1:
+                item.resource.sha1 = cached_media.sha1
+        
+        return job
+
+    def cache_job_media(self, job:DownloadJob) -> DownloadJob:
+        """Adds the hashed media files of the job to the media cache
+
+        Args:
+            job (DownloadJob): The job with the downloaded and hashed media
+
+        Returns:
+            DownloadJob: The provided job
+        """
+        if not self.media_cache:
+            return job
+
+        for item in job.download_items:
+            if item.ignore or not item.media_file or not item.media_file.exists():
+                continue
+
+            md5 = item.md5 or item.resource.md5
+            if not md5:
+                continue
+
+            self.media_cache.add(file=item.media_file, md5=md5, sha1=item.sha1 or item.resource.sha1 or "")
+        
+        return job
+
+    async def download_file(self, session:aiohttp.ClientSession, url:str, file_path:Path, headers:dict=None, expected_md5:str="") -> tuple[str, str]:
+        """Downloads the url to the file, hashing the content as it's written
+
+        Each chunk is hashed and written in a worker thread so large files don't hold up the event loop
+
+        Args:
+            session (aiohttp.ClientSession): The session to download with
+            url (str): The url of the file
+            file_path (Path): Where to write the file
+            headers (dict, optional): Extra headers for the request. Defaults to None.
+            expected_md5 (str, optional): The md5 hash the file should have. Defaults to "".
+
+        Raises:
+            errors.HashMismatch: When the downloaded file doesn't match the expected md5 hash, the file is deleted
+
+        Returns:
+            tuple[str, str]: The md5 and sha1 hashes of the downloaded file
+        """
+        md5_hash = hashlib.md5()
+        sha1_hash = hashlib.sha1()
+
+        def write_chunk(file, chunk:bytes) -> None:
+            md5_hash.update(chunk)
+            sha1_hash.update(chunk)
+            file.write(chunk)
+            return None
+
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        logger.debug(f"Downloading '{url}' to '{file_path}'")
+
+        async with session.get(url=url, headers=headers) as response:
+            response.raise_for_status()
+            with open(file_path, "wb") as file:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(write_chunk, file, chunk)
+
+        file_md5 = md5_hash.hexdigest()
+        file_sha1 = sha1_hash.hexdigest()
+
+        if expected_md5 and file_md5 != expected_md5.lower():
+            file_path.unlink()
+            raise errors.HashMismatch(f"Downloaded file from '{url}' has md5 hash '{file_md5}' instead of '{expected_md5}'")
+
+        return file_md5, file_sha1
+
+    async def create_download_job_async(self, params:list) -> DownloadJob:
         raise NotImplementedError
 
-    def download(self, url:str) -> Generator[DownloadJob, None, None]:
-        raise NotImplementedError
\ No newline at end of file
+    async def download_async(self, url:str) -> AsyncGenerator[DownloadJob, None]:
+        raise NotImplementedError
+        yield
\ No newline at end of file
@@ -1,10 +1,27 @@
-from typing import Generator
+from typing import AsyncGenerator, Callable
 from loguru import logger
 from pathlib import Path
-import subprocess
+from gallery_dl import job as gallerydl_job, config as gallerydl_config, exception as gallerydl_exception, option as gallerydl_option
+import threading
+import asyncio
+import aiohttp
+import json
 
 from booru_tools.downloaders import _base
-from booru_tools.shared import constants, config
+from booru_tools.shared import constants, config, errors
+
+class StreamingDataJob(gallerydl_job.DataJob):
+    """A gallery-dl DataJob that hands each file's url and metadata to a callback as soon as it is extracted
+    """
+    def __init__(self, url, parent=None, file=None, ensure_ascii=True, resolve=True, callback:Callable[[str, dict], None]=None):
+        super().__init__(url, parent, file, ensure_ascii, resolve)
+        self.callback = callback if callback else parent.callback
+
+    def handle_url(self, url:str, kwdict:dict) -> None:
+        self.callback(url, self.filter(kwdict))
+
+    def handle_directory(self, kwdict:dict) -> None:
+        pass
 
 class GalleryDlManager(_base.DownloadManager):
     def __init__(self, extractor:str=None, page_size:int=50, extra_params:list=[]):
@@ -15,38 +32,70 @@ class GalleryDlManager(_base.DownloadManager):
 
         config_manager = config.ConfigManager()
         cookies_file = config_manager['networking']['cookies_file']
+        self.cookies_file:Path = cookies_file
         if cookies_file:
             logger.debug(f"Using cookies file '{cookies_file}'")
             self.extra_params.extend([
                 "--cookies",
                 f"{cookies_file}"
             ])
+
+        max_processes = config_manager['downloaders']['gallery_dl']['max_processes']
+        self.process_semaphore = asyncio.Semaphore(max_processes or 1)
+        self.streaming:bool = config_manager['downloaders']['gallery_dl']['streaming']
+        self.native_media_download:bool = config_manager['downloaders']['gallery_dl']['native_media_download']
+        self.max_media_downloads:int = config_manager['downloaders']['gallery_dl']['max_media_downloads'] or 1
+        self._gallerydl_config_loaded = False
     
     def add_extractor_to_url(self, url:str) -> str:
         if self.extractor and not url.startswith(self.extractor):
             url = f"{self.extractor}:{url}"
         return url
 
-    def call_gallerydl(self, params:list = []) -> None:
+    async def call_gallerydl_async(self, params:list = []) -> None:
+        """Runs gallery-dl as a subprocess without blocking the event loop
+
+        The number of gallery-dl processes running at once is limited by the 'max_processes' config value
+
+        Args:
+            params (list, optional): The parameters to pass to gallery-dl. Defaults to [].
+        """
         command = [
             "gallery-dl",
             *self.extra_params,
             *params
         ]
 
-        subprocess.run(command)
+        async with self.process_semaphore:
+            process = await asyncio.create_subprocess_exec(*command)
+            try:
+                return_code = await process.wait()
+            except asyncio.CancelledError:
+                logger.debug(f"Killing gallery-dl process {process.pid}")
+                process.kill()
+                await process.wait()
+                raise
+        
+        if return_code:
+            logger.debug(f"gallery-dl exited with return code {return_code}")
         return None
     
-    def download_info(self, urls:list[str], download_directory:Path) -> list[_base.DownloadItem]:
+    async def download_info_async(self, urls:list[str], download_directory:Path) -> list[_base.DownloadItem]:
+        params = self._download_info_params(urls=urls, download_directory=download_directory)
+        await self.call_gallerydl_async(params)
+        items = self._find_download_items(download_directory=download_directory)
+        return items
+
+    def _download_info_params(self, urls:list[str], download_directory:Path) -> list[str]:
         params = [
             "--write-metadata", 
             "--no-download",
             f"-D={download_directory}",
             *urls
         ]
+        return params
 
-        self.call_gallerydl(params)
-
+    def _find_download_items(self, download_directory:Path) -> list[_base.DownloadItem]:
         items:list[_base.DownloadItem] = []
 
         for json_file in download_directory.rglob(f"*.json"):
@@ -57,14 +106,35 @@ class GalleryDlManager(_base.DownloadManager):
         
         return items
 
-    def download_pending_items(self, job:_base.DownloadJob) -> _base.DownloadJob:
-        urls = []
+    async def download_pending_items_async(self, job:_base.DownloadJob, session:aiohttp.ClientSession=None) -> _base.DownloadJob:
+        job = self.link_cached_media(job=job)
+
+        if session and self.native_media_download:
+            job = await self._download_streamed_items(job=job, session=session)
+
+        urls = self._pending_item_urls(job=job)
+
+        if not urls:
+            logger.debug("No media files to download")
+            return job
         
-        for item in job.download_items:
+        params = [
+            f"-D={job.download_folder}",
+            *self._media_url_params(job=job, urls=urls)
+        ]
+        await self.call_gallerydl_async(params)
+
+        job = self._find_downloaded_media(job=job)
+        return job
+
+    def _pending_item_urls(self, job:_base.DownloadJob) -> dict[int, str]:
+        urls:dict[int, str] = {}
+        
+        for index, item in enumerate(job.download_items):
             if not item.media_download_desired:
                 continue
 
-            if item.ignore:
+            if item.ignore or item.media_file:
                 continue
 
             if item.resource.post_url:
@@ -75,26 +145,100 @@ class GalleryDlManager(_base.DownloadManager):
             
             if download_url:
                 download_url = self.add_extractor_to_url(download_url)
-                urls.append(download_url)
-
-        if not urls:
-            logger.debug("No media files to download")
-            return job
+                urls[index] = download_url
         
-        params = [
-            *self.extra_params,
-            f"-D={job.download_folder}",
-            *urls
+        return urls
+
+    async def _download_streamed_items(self, job:_base.DownloadJob, session:aiohttp.ClientSession) -> _base.DownloadJob:
+        """Downloads the media of streamed items straight from their media url, hashing each file as it's written
+
+        Up to 'max_media_downloads' items are downloaded at once. Items that fail to download or don't match
+        their metadata md5 are left for gallery-dl to download
+
+        Args:
+            job (_base.DownloadJob): The job with the items to download
+            session (aiohttp.ClientSession): The session to download with
+
+        Returns:
+            _base.DownloadJob: The job with the media files and hashes set on the downloaded items
+        """
+        pending_items = [
+            (index, item) for index, item in enumerate(job.download_items)
+            if item.media_download_desired and not item.ignore and item.media_url and item.metadata
         ]
-        self.call_gallerydl(params)
+        download_semaphore = asyncio.Semaphore(self.max_media_downloads)
+
+        async def download_item(index:int, item:_base.DownloadItem) -> None:
+            extension = item.metadata.get("extension") or Path(item.media_url.split("?")[0]).suffix.lstrip(".")
+            media_file = job.download_folder / f"{index}.{extension}"
+            headers = {"Referer": item.resource.post_url} if item.resource.post_url else None
+
+            try:
+                async with download_semaphore:
+                    item.md5, item.sha1 = await self.download_file(
+                        session=session,
+                        url=item.media_url,
+                        file_path=media_file,
+                        headers=headers,
+                        expected_md5=item.resource.md5
+                    )
+            except errors.HashMismatch as e:
+                logger.error(f"{e}, leaving '{item.resource.id}' for gallery-dl to download")
+                return None
+            except aiohttp.ClientError as e:
+                logger.warning(f"Failed to download '{item.media_url}' with '{e}', leaving '{item.resource.id}' for gallery-dl to download")
+                return None
 
-        for item in job.download_items:
+            logger.debug(f"Downloaded '{media_file}' with md5 '{item.md5}' and sha1 '{item.sha1}'")
+            item.media_file = media_file
+            item.resource.local_file = media_file
+            item.resource.md5 = item.md5
+            item.resource.sha1 = item.sha1
+            return None
+
+        async with asyncio.TaskGroup() as task_group:
+            for index, item in pending_items:
+                task_group.create_task(download_item(index=index, item=item))
+        return job
+
+    def _media_url_params(self, job:_base.DownloadJob, urls:dict[int, str]) -> list[str]:
+        """Creates the gallery-dl url parameters for the media downloads of a job
+
+        Streamed items have no metadata file to find their media file with, so their urls are passed
+        through an input file that sets the filename of each download to the item's index in the job
+
+        Args:
+            job (_base.DownloadJob): The job the urls belong to
+            urls (dict[int, str]): The download urls keyed by the index of their item in the job
+
+        Returns:
+            list[str]: The parameters to pass to gallery-dl
+        """
+        streamed_urls = {index: url for index, url in urls.items() if not job.download_items[index].metadata_file}
+        params = [url for index, url in urls.items() if index not in streamed_urls]
+
+        if streamed_urls:
+            job.download_folder.mkdir(parents=True, exist_ok=True)
+            input_file = job.download_folder / "input-urls.txt"
+            with open(input_file, "w") as file:
+                for index, url in streamed_urls.items():
+                    file.write(f"-filename = {json.dumps(f'{index}.{{extension}}')}\n")
+                    file.write(f"{url}\n")
+            params.append(f"--input-file={input_file}")
+
+        return params
+
+    def _find_downloaded_media(self, job:_base.DownloadJob) -> _base.DownloadJob:
+        for index, item in enumerate(job.download_items):
             if not item.media_download_desired:
                 continue
 
-            downloaded_file = item.metadata_file.parent / item.metadata_file.stem
+            if item.metadata_file:
+                downloaded_file = item.metadata_file.parent / item.metadata_file.stem
+            else:
+                downloaded_file = next(job.download_folder.glob(f"{index}.*"), None)
             
-            if not downloaded_file.exists():
+            if not downloaded_file or not downloaded_file.exists():
                 continue
 
             logger.debug(f"Found '{downloaded_file}' media file")
@@ -103,9 +247,9 @@ class GalleryDlManager(_base.DownloadManager):
                 
         return job
 
-    def create_download_job(self, params:list) -> _base.DownloadJob:
+    async def create_download_job_async(self, params:list) -> _base.DownloadJob:
         temp_folder = self.create_temp_folder()
-        download_items = self.download_info(params, temp_folder)
+        download_items = await self.download_info_async(params, temp_folder)
         
         job = _base.DownloadJob(
             download_folder = temp_folder,
@@ -115,7 +259,12 @@ class GalleryDlManager(_base.DownloadManager):
 
         return job
 
-    def download(self, url:str) -> Generator[_base.DownloadJob, None, None]:
+    async def download_async(self, url:str) -> AsyncGenerator[_base.DownloadJob, None]:
+        if self.streaming:
+            async for job in self.stream_download(url=url):
+                yield job
+            return
+
         min_range = 0
         max_range = self.page_size
 
@@ -129,12 +278,110 @@ class GalleryDlManager(_base.DownloadManager):
                 self.add_extractor_to_url(url)
             ]
 
-            job = self.create_download_job(params)
+            job = await self.create_download_job_async(params)
             downloaded_item_count = job.all_item_count
 
             min_range = max_range + 1
             max_range += self.page_size
             
             yield job
+
+    async def stream_download(self, url:str) -> AsyncGenerator[_base.DownloadJob, None]:
+        """Runs a single gallery-dl extraction for the url in-process, yielding jobs of up to 'page_size' items as they are extracted
+
+        Unlike download_async this walks the search results once instead of starting a new gallery-dl process per page,
+        and the metadata is read straight from the extractor instead of from written metadata files
+
+        Args:
+            url (str): The url to extract posts from
+
+        Yields:
+            _base.DownloadJob: A job for every 'page_size' extracted items
+        """
+        loop = asyncio.get_running_loop()
+        item_queue:asyncio.Queue[_base.DownloadItem|None] = asyncio.Queue(maxsize=self.page_size)
+        stop_event = threading.Event()
+
+        extraction_task = asyncio.create_task(
+            asyncio.to_thread(self._run_streaming_job, url, loop, item_queue, stop_event)
+        )
+
+        try:
+            download_items:list[_base.DownloadItem] = []
+            while item := await item_queue.get():
+                download_items.append(item)
+                if len(download_items) < self.page_size:
+                    continue
+                yield self._create_streamed_job(download_items=download_items)
+                download_items = []
+
+            yield self._create_streamed_job(download_items=download_items)
+            await extraction_task
+        finally:
+            stop_event.set()
+            while not extraction_task.done():
+                while not item_queue.empty():
+                    item_queue.get_nowait()
+                await asyncio.wait([extraction_task], timeout=0.1)
+
+    def _create_streamed_job(self, download_items:list[_base.DownloadItem]) -> _base.DownloadJob:
+        job = _base.DownloadJob(
+            download_folder = self.create_temp_folder(),
+            download_items=download_items,
+            _download_manager = self
+        )
+        return job
+
+    def _run_streaming_job(self, url:str, loop:asyncio.AbstractEventLoop, item_queue:asyncio.Queue, stop_event:threading.Event) -> None:
+        self._load_gallerydl_config()
+
+        def put_item(media_url:str, metadata:dict) -> None:
+            if stop_event.is_set():
+                raise gallerydl_exception.StopExtraction()
+            # Round trip through json so the metadata matches what --write-metadata would have written
+            metadata = json.loads(json.dumps(metadata, default=str))
+            item = _base.DownloadItem(
+                metadata=metadata,
+                media_url=media_url
+            )
+            asyncio.run_coroutine_threadsafe(item_queue.put(item), loop).result()
+
+        try:
+            data_job = StreamingDataJob(self.add_extractor_to_url(url), callback=put_item)
+            data_job.run()
+            if data_job.exception:
+                logger.warning(f"gallery-dl extraction for '{url}' stopped with '{data_job.exception}'")
+        finally:
+            if not stop_event.is_set():
+                asyncio.run_coroutine_threadsafe(item_queue.put(None), loop).result()
+        return None
+
+    def _load_gallerydl_config(self) -> None:
+        if self._gallerydl_config_loaded:
+            return None
         
-        return
\ No newline at end of file
+        gallerydl_config.load()
+        self._apply_extra_params()
+        if self.cookies_file:
+            gallerydl_config.set(("extractor",), "cookies", str(self.cookies_file))
+        self._gallerydl_config_loaded = True
+        return None
+
+    def _apply_extra_params(self) -> None:
+        """Applies the gallery-dl command line options in 'extra_params' to the in-process gallery-dl config,
+        so streaming jobs use the same options as the gallery-dl subprocess
+        """
+        if not self.extra_params:
+            return None
+
+        parser = gallerydl_option.build_parser()
+        args, unknown_params = parser.parse_known_args([str(param) for param in self.extra_params])
+        ignored_params = [*unknown_params, *args.urls]
+        if ignored_params:
+            logger.warning(f"Ignoring gallery-dl parameters {ignored_params} as they aren't options that can be applied to the streaming job config")
+
+        if args.configs_extra:
+            gallerydl_config.load(args.configs_extra, strict=True)
+        for options in args.options:
+            gallerydl_config.set(*options)
+        return None
@@ -0,0 +1,208 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from loguru import logger
+import functools
+import sqlite3
+import shutil
+import time
+import os
+
+from booru_tools.shared import config
+
+LAST_USED_FLUSH_SIZE = 100 # The number of pending last used times that are written in one go
+
+@dataclass(kw_only=True)
+class CachedMedia:
+    md5:str
+    sha1:str = field(default="")
+    path:Path
+    size:int = field(default=0)
+
+class MediaCache:
+    """An on-disk media cache keyed by md5/sha1, evicting the least recently used files once it grows over 'max_size' bytes
+
+    Cache hits only note their last used time in memory, the times are written in batches, before evicting and on close
+    """
+    def __init__(self, directory:Path, max_size:int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self._connection:sqlite3.Connection = None
+        self._pending_last_used:dict[str, float] = {}
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection:
+            return self._connection
+
+        logger.debug(f"Opening media cache in '{self.directory}' with a limit of {self.max_size} bytes")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.directory / "index.sqlite")
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                md5 TEXT PRIMARY KEY,
+                sha1 TEXT,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS media_sha1 ON media (sha1)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS media_last_used ON media (last_used)")
+        self._connection.commit()
+        return self._connection
+
+    def get(self, md5:str="", sha1:str="") -> CachedMedia|None:
+        """Gets the cached media matching either hash, marking it as recently used
+
+        Args:
+            md5 (str, optional): The md5 hash of the media. Defaults to "".
+            sha1 (str, optional): The sha1 hash of the media. Defaults to "".
+
+        Returns:
+            CachedMedia|None: The cached media, or None if it isn't cached
+        """
+        if md5:
+            row = self.connection.execute("SELECT * FROM media WHERE md5 = ?", (md5.lower(),)).fetchone()
+        elif sha1:
+            row = self.connection.execute("SELECT * FROM media WHERE sha1 = ?", (sha1.lower(),)).fetchone()
+        else:
+            return None
+
+        if not row:
+            return None
+
+        cached_media = CachedMedia(
+            md5=row["md5"],
+            sha1=row["sha1"],
+            path=self.directory / row["path"],
+            size=row["size"]
+        )
+
+        if not cached_media.path.exists():
+            logger.warning(f"Cached media '{cached_media.path}' is missing, removing it from the cache")
+            self._remove(cached_media=cached_media)
+            return None
+
+        self._pending_last_used[cached_media.md5] = time.time()
+        if len(self._pending_last_used) >= LAST_USED_FLUSH_SIZE:
+            self.flush()
+        return cached_media
+
+    def add(self, file:Path, md5:str, sha1:str="") -> CachedMedia|None:
+        """Adds the file to the cache, then evicts the least recently used files until the cache is within its size limit
+
+        Args:
+            file (Path): The media file to cache
+            md5 (str): The md5 hash of the file
+            sha1 (str, optional): The sha1 hash of the file. Defaults to "".
+
+        Returns:
+            CachedMedia|None: The cached media, or None if the file is larger than the whole cache
+        """
+        if cached_media := self.get(md5=md5):
+            return cached_media
+
+        file_size = file.stat().st_size
+        if file_size > self.max_size:
+            logger.debug(f"Not caching '{file}' as its size of {file_size} bytes is over the cache limit")
+            return None
+
+        md5 = md5.lower()
+        relative_path = Path(md5[:2]) / f"{md5}{file.suffix}"
+        cached_media = CachedMedia(
+            md5=md5,
+            sha1=sha1.lower(),
+            path=self.directory / relative_path,
+            size=file_size
+        )
+
+        logger.debug(f"Caching '{file}' as '{cached_media.path}'")
+        cached_media.path.parent.mkdir(parents=True, exist_ok=True)
+        self._link_file(source=file, destination=cached_media.path)
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO media (md5, sha1, path, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            (cached_media.md5, cached_media.sha1, str(relative_path), cached_media.size, time.time())
+        )
+        self.connection.commit()
+
+        self.evict()
+        return cached_media
+
+    def link(self, cached_media:CachedMedia, destination:Path) -> Path:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        self._link_file(source=cached_media.path, destination=destination)
+        return destination
+
+    def flush(self) -> None:
+        """Writes the pending last used times of cache hits to the index
+        """
+        if not self._pending_last_used:
+            return None
+        self.connection.executemany(
+            "UPDATE media SET last_used = ? WHERE md5 = ?",
+            [(last_used, md5) for md5, last_used in self._pending_last_used.items()]
+        )
+        self.connection.commit()
+        self._pending_last_used = {}
+        return None
+
+    def evict(self) -> None:
+        self.flush()
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+        if total_size <= self.max_size:
+            return None
+
+        rows = self.connection.execute("SELECT * FROM media ORDER BY last_used ASC").fetchall()
+        for row in rows:
+            if total_size <= self.max_size:
+                break
+            cached_media = CachedMedia(
+                md5=row["md5"],
+                sha1=row["sha1"],
+                path=self.directory / row["path"],
+                size=row["size"]
+            )
+            logger.debug(f"Evicting '{cached_media.path}' from the media cache")
+            self._remove(cached_media=cached_media)
+            total_size -= cached_media.size
+        return None
+
+    def close(self) -> None:
+        if self._connection:
+            self.flush()
+            self._connection.close()
+            self._connection = None
+        return None
+
+    def _remove(self, cached_media:CachedMedia) -> None:
+        cached_media.path.unlink(missing_ok=True)
+        self._pending_last_used.pop(cached_media.md5, None)
+        self.connection.execute("DELETE FROM media WHERE md5 = ?", (cached_media.md5,))
+        self.connection.commit()
+        return None
+
+    @staticmethod
+    def _link_file(source:Path, destination:Path) -> None:
+        if destination.exists():
+            destination.unlink()
+        try:
+            os.link(source, destination)
+        except OSError as e:
+            logger.debug(f"Could not hard link '{source}' to '{destination}' due to '{e}', copying instead")
+            shutil.copy2(source, destination)
+        return None
+
+@functools.cache
+def get_media_cache() -> MediaCache|None:
+    """Gets the media cache shared by all download managers
+
+    Returns:
+        MediaCache|None: The media cache, or None if it's disabled in the config
+    """
+    config_manager = config.ConfigManager()
+    media_cache_config = config_manager["downloaders"]["media_cache"]
+    if not media_cache_config["max_size"]:
+        return None
+    return MediaCache(directory=media_cache_config["directory"], max_size=media_cache_config["max_size"])
@@ -2,7 +2,7 @@ from loguru import logger
 from base64 import b64encode
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator
 import aiohttp
 import asyncio
 import re
@@ -67,9 +67,13 @@ class MetadataPlugin(_base.PluginBase):
     
     def _from_metadata_file(self, metadata_file:Path, plugins:resources.InternalPlugins=None) -> resources.InternalPost:
         data = self._load_metadata_file_data(metadata_file)
+        post = self._from_metadata(data=data, plugins=plugins, metadata_file=metadata_file.absolute())
+        return post
+
+    def _from_metadata(self, data:dict, plugins:resources.InternalPlugins=None, metadata_file:Path=None) -> resources.InternalPost:
         metadata = resources.Metadata(
             data=data,
-            file=metadata_file.absolute()
+            file=metadata_file
         )
         
         if not plugins:
@@ -169,7 +173,10 @@ class ApiPlugin(_base.PluginBase):
         download_directory.mkdir(parents=True, exist_ok=True)
         return download_directory
     
-    async def find_exact_post(self, post:resources.InternalPost) -> resources.InternalPost | None:
+    async def find_exact_post(self, post:resources.InternalPost, check_hashes:bool=True) -> resources.InternalPost | None:
+        raise NotImplementedError
+
+    async def find_exact_posts(self, posts:list[resources.InternalPost]) -> dict[str, resources.InternalPost]:
         raise NotImplementedError
     
     async def find_similar_posts(self, post:resources.InternalPost) -> list[resources.InternalPost]:
@@ -190,10 +197,28 @@ class ApiPlugin(_base.PluginBase):
     async def get_all_posts(self) -> list[resources.InternalPost]:
         raise NotImplementedError
 
+    def iter_all_pools(self, batch_size:int=1000) -> AsyncIterator[list[resources.InternalPool]]:
+        raise NotImplementedError
+
+    def iter_all_posts(self, minimum_score:int=None, allowed_safety:list[str]=None, batch_size:int=1000) -> AsyncIterator[list[resources.InternalPost]]:
+        raise NotImplementedError
+
     async def push_tag(self, tag:resources.InternalTag, replace_tags:bool=False, create_empty_tags:bool=True) -> resources.InternalTag:
         raise NotImplementedError
 
-    async def push_post(self, post:resources.InternalPost) -> resources.InternalPost:
+    async def create_tag(self, tag:resources.InternalTag) -> resources.InternalTag:
+        raise NotImplementedError
+
+    async def update_tag(self, tag:resources.InternalTag) -> resources.InternalTag:
+        raise NotImplementedError
+
+    async def merge_tag(self, from_tag:resources.InternalTag, to_tag:resources.InternalTag) -> resources.InternalTag:
+        raise NotImplementedError
+
+    async def delete_tag(self, tag:resources.InternalTag) -> None:
+        raise NotImplementedError
+
+    async def push_post(self, post:resources.InternalPost, exact_post:resources.InternalPost=None, check_exact_post:bool=True) -> resources.InternalPost:
         raise NotImplementedError
 
     async def push_pool(self, pool:resources.InternalPool) -> resources.InternalPool:
@@ -73,10 +73,7 @@ class DanbooruMeta(SharedAttributes, _plugin_template.MetadataPlugin):
             logger.debug(f"Found tag string {key}")
             category = key.replace("tags_", "")
             for tag in value:
-                tag = resources.InternalTag(
-                    names=[tag],
-                    category=category
-                )
+                tag = resources.get_tag(name=tag, category=category)
                 all_tags.append(tag)
         
         logger.debug(f"Found {len(all_tags)} tags")
@@ -79,12 +79,11 @@ class DerpibooruMeta(SharedAttributes, _plugin_template.MetadataPlugin):
             if not tag_name:
                 continue
 
-            tag_data = {
-                "names": [tag_name.lower()],
-                "category": tag_category,
-                "implications": tag_implications
-            }
-            tag_resource = resources.InternalTag.from_dict(tag_data)
+            tag_resource = resources.get_tag(
+                name=tag_name.lower(),
+                category=tag_category,
+                implications=tag_implications
+            )
             all_tags.append(tag_resource)
 
         return all_tags
@@ -3,15 +3,18 @@ from datetime import datetime
 from pathlib import Path
 from bs4 import BeautifulSoup
 from async_lru import alru_cache
+from typing import AsyncIterator, Iterator
 import gzip, csv
+import itertools
 import aiohttp
 import asyncio
 import re
 import functools
-import requests
+import json
 
 from booru_tools.plugins import _plugin_template
-from booru_tools.shared import errors, constants, resources
+from booru_tools.shared import errors, constants, resources, rate_limit
+from booru_tools.shared import tag_graph as tag_graph_builder
 
 class SharedAttributes:
     _DOMAINS = [
@@ -71,10 +74,7 @@ class E621Meta(SharedAttributes, _plugin_template.MetadataPlugin):
 
         for category, tags in metadata.get("tags", {}).items():
             for tag in tags:
-                tag = resources.InternalTag(
-                    names=[tag],
-                    category=category
-                )
+                tag = resources.get_tag(name=tag, category=category)
                 all_tags.append(tag)
         
         logger.debug(f"Found {len(all_tags)} tags")
@@ -148,37 +148,108 @@ class E621Client(SharedAttributes, _plugin_template.ApiPlugin):
         }
         self.tag_post_count_threshold = 5
         self.tmp_path = constants.TEMP_FOLDER
+        self.db_export_directory:Path = Path("e621_db_export")
+        self.db_export_chunk_size:int = 1024 * 1024
+        self.pool_page_size:int = 100
+        # e621 allows at most 2 requests per second, so the limiter only ever adapts downwards from there
+        self.rate_limit:dict = {}
+        self._rate_limiter:rate_limit.AdaptiveRateLimiter = None
 
-    async def get_pool(self, id:int) -> resources.InternalPool:
-        url = f"{self.URL_BASE}/pools.json?search[id]={id}"
+    @property
+    def rate_limiter(self) -> rate_limit.AdaptiveRateLimiter:
+        # Created on first use, as the plugin config is applied after __init__
+        if not self._rate_limiter:
+            rate_limit_config = {
+                "initial_rate": 2.0,
+                "max_rate": 2.0,
+                "initial_concurrency": 2,
+                "max_concurrency": 2,
+                **self.rate_limit
+            }
+            self._rate_limiter = rate_limit.AdaptiveRateLimiter(name="e621", **rate_limit_config)
+            logger.debug(f"Created rate limiter {self._rate_limiter}")
+        return self._rate_limiter
+
+    async def get_pool(self, id:int) -> resources.InternalPool|None:
+        pools = await self.get_pools(ids=[id])
+        if not pools:
+            return None
+        return pools[0]
+
+    async def get_pools(self, ids:list[int]) -> list[resources.InternalPool]:
+        """Gets the pools with the given ids, requesting up to 'pool_page_size' pools per request
+
+        Args:
+            ids (list[int]): The ids of the pools to get
+
+        Returns:
+            list[resources.InternalPool]: The pools that were found, in the order of the given ids
+        """
+        unique_ids = list(dict.fromkeys(int(id) for id in ids))
+        id_pages = [unique_ids[index:index + self.pool_page_size] for index in range(0, len(unique_ids), self.pool_page_size)]
+
+        async with asyncio.TaskGroup() as task_group:
+            page_tasks = [task_group.create_task(self._get_pools_page(ids=id_page)) for id_page in id_pages]
+
+        pools_by_id:dict[int, resources.InternalPool] = {}
+        for page_task in page_tasks:
+            for pool_data in page_task.result():
+                pool = resources.InternalPool(
+                    id=pool_data["id"],
+                    names=[pool_data["name"]],
+                    category=pool_data.get("category", ""),
+                    description=pool_data.get("description", ""),
+                    created_at=datetime.fromisoformat(pool_data["created_at"]),
+                    updated_at=datetime.fromisoformat(pool_data["updated_at"]),
+                    posts=self._create_pool_posts(post_ids=pool_data["post_ids"])
+                )
+                pools_by_id[pool.id] = pool
 
-        response = requests.get(
-            url=url,
-            headers=self.headers
-        )
+        logger.debug(f"Found {len(pools_by_id)} of {len(unique_ids)} pools")
+        return [pools_by_id[id] for id in unique_ids if id in pools_by_id]
 
-        pools = response.json()
+    @errors.RetryOnExceptions()
+    async def _get_pools_page(self, ids:list[int]) -> list[dict]:
+        url = f"{self.URL_BASE}/pools.json"
+        params = {
+            "search[id]": ",".join(str(id) for id in ids),
+            "limit": len(ids)
+        }
 
         try:
-            pool_data = pools[0]
-            pool = resources.InternalPool(
-                id=pool_data["id"],
-                title=pool_data["name"],
-                category=pool_data.get("category"),
-                description=pool_data.get("description"),
-                posts=pool_data["post_ids"]
-            )
-        except KeyError:
-            pool = None
+            async with self.rate_limiter.request(), self.session.get(
+                url=url,
+                params=params,
+                headers=self.headers
+                ) as response:
+                response.raise_for_status()
+                pools:list[dict] = await response.json()
+        except aiohttp.ClientResponseError as e:
+            if mapped_error := errors.HTTP_CODE_MAP.get(e.status, None):
+                error = mapped_error(f"e621 responded with {e.status} when getting pools")
+                error.retry_after = errors.get_retry_after(e)
+                raise error from e
+            raise e
 
-        return pool
+        return pools
+
+    def _create_pool_posts(self, post_ids:list[int|str]) -> list[resources.InternalPost]:
+        e621_metadata_plugin = E621Meta()
+        return [
+            resources.InternalPost(
+                id=int(post_id),
+                sources=[],
+                post_url=e621_metadata_plugin._generate_post_url(post_id),
+                origin=self._NAME
+            ) for post_id in post_ids if post_id
+        ]
 
     async def get_all_tags(self, treat_aliases_as_implications:bool=False) -> list[resources.InternalTag]:
         tag_aliases_export_archive = await self._download_latest_db_export(filename_string="tag_aliases-")
         tag_implications_export_archive = await self._download_latest_db_export(filename_string="tag_implications-")
         tags_export_archive = await self._download_latest_db_export(filename_string="tags-")
 
-        tags:dict[str, resources.InternalTag] = {}
+        tag_graph = tag_graph_builder.TagGraphBuilder()
 
         with gzip.open(tags_export_archive, "rt") as tags_gz:
             logger.info(f"Processing tags from {tags_export_archive}")
@@ -199,14 +270,10 @@ class E621Client(SharedAttributes, _plugin_template.ApiPlugin):
                     # logger.debug(f"Skipping tag '{name}' as its in the {constants.TagCategory.INVALID} category")
                     continue
                 
-                tags[name] = resources.InternalTag(
-                    names=[name],
-                    category=category
-                )
-                # logger.debug(f"Added tag {name}")
+                tag_graph.add_tag(name=name, category=category)
 
         with gzip.open(tag_aliases_export_archive, "rt") as tag_aliases_gz:
-            logger.info(f"Processing tag aliases from {tags_export_archive}")
+            logger.info(f"Processing tag aliases from {tag_aliases_export_archive}")
             tag_aliases_csv_reader = csv.DictReader(tag_aliases_gz)
 
             for tag_alias in tag_aliases_csv_reader:
@@ -215,91 +282,95 @@ class E621Client(SharedAttributes, _plugin_template.ApiPlugin):
                 name = tag_alias["consequent_name"]
                 alias = tag_alias["antecedent_name"]
 
-                if alias in tags and name in tags:
-                    self._merge_tags(tags=tags, from_name=alias, to_name=name)
+                if treat_aliases_as_implications and not (tag_graph.is_tag(name=alias) and tag_graph.is_tag(name=name)):
+                    tag_graph.add_implication(name=name, implication=alias)
                     continue
 
-                if treat_aliases_as_implications:
-                    tags = self._add_implication(
-                        tags=tags,
-                        name=name,
-                        implication=alias
-                    )
-                else:
-                    tags = self._add_alias(
-                        tags=tags,
-                        name=name,
-                        alias=alias
-                    )
+                tag_graph.add_alias(name=name, alias=alias)
 
         with gzip.open(tag_implications_export_archive, "rt") as tag_implications_gz:
-            logger.info(f"Processing tag implications from {tags_export_archive}")
+            logger.info(f"Processing tag implications from {tag_implications_export_archive}")
             tag_implications_csv_reader = csv.DictReader(tag_implications_gz)
 
             for tag_implication in tag_implications_csv_reader:
                 if tag_implication.get("status", "deleted") != "active":
                     continue
-                name = tag_implication["antecedent_name"]
-                implication = tag_implication["consequent_name"]
-
-                tags = self._add_implication(
-                    tags=tags,
-                    name=name,
-                    implication=implication
+                tag_graph.add_implication(
+                    name=tag_implication["antecedent_name"],
+                    implication=tag_implication["consequent_name"]
                 )
         
-        return list(set(tags.values()))
+        return tag_graph.build()
     
     async def get_all_pools(self) -> list[resources.InternalPool]:
-        pools_export_archive = await self._download_latest_db_export(filename_string="pools-")
-
         pools:list[resources.InternalPool] = []
-        e621_metadata_plugin = E621Meta()
+        async for pool_batch in self.iter_all_pools():
+            pools.extend(pool_batch)
+        return pools
 
-        with gzip.open(pools_export_archive, "rt") as pools_gz:
-            pools_csv_reader = csv.DictReader(pools_gz)
+    async def iter_all_pools(self, batch_size:int=1000) -> AsyncIterator[list[resources.InternalPool]]:
+        """Reads the active pools from the latest pools db export, yielding them in batches as the export is parsed
 
-            for pool in pools_csv_reader:
+        Args:
+            batch_size (int, optional): The number of pools in each batch. Defaults to 1000.
+
+        Yields:
+            list[resources.InternalPool]: The next batch of pools
+        """
+        pools_export_archive = await self._download_latest_db_export(filename_string="pools-")
+
+        async for pool_rows in self._iter_db_export_batches(db_export_archive=pools_export_archive, batch_size=batch_size):
+            pools:list[resources.InternalPool] = []
+
+            for pool in pool_rows:
                 if pool.get("is_active", "f") != "t":
                     continue
                 
                 pool_id = int(pool["id"])
-                logger.info(f"Processing pool {pool_id}")
-
-                pool_data = {
-                    "id": pool_id,
-                    "name": pool["name"],
-                    "created_at": datetime.fromisoformat(pool["created_at"]),
-                    "updated_at": datetime.fromisoformat(pool["updated_at"]),
-                    "description": pool["description"],
-                    "category": pool["category"]
-                }
+                logger.debug(f"Processing pool {pool_id}")
 
                 post_ids:list[str] = pool["post_ids"].strip("{}").split(",")
-                posts = []
-                for post_id in post_ids:
-                    post = {
-                        "id": post_id,
-                        "post_url": e621_metadata_plugin._generate_post_url(post_id),
-                        "origin": self._NAME
-                    }
-                    posts.append(post)
-                pool_data["posts"] = posts
-
-                pools.append(resources.InternalPool.from_dict(pool_data))
-            
-        return pools
+                posts = self._create_pool_posts(post_ids=post_ids)
+
+                pools.append(resources.InternalPool(
+                    id=pool_id,
+                    names=[pool["name"]],
+                    created_at=datetime.fromisoformat(pool["created_at"]),
+                    updated_at=datetime.fromisoformat(pool["updated_at"]),
+                    description=pool["description"],
+                    category=pool["category"],
+                    posts=posts
+                ))
+
+            if pools:
+                yield pools
     
-    async def get_all_posts(self) -> list[resources.InternalPost]:
-        posts_export_archive = await self._download_latest_db_export(filename_string="posts-")
-
+    async def get_all_posts(self, minimum_score:int=None, allowed_safety:list[str]=None) -> list[resources.InternalPost]:
         posts:list[resources.InternalPost] = []
+        async for post_batch in self.iter_all_posts(minimum_score=minimum_score, allowed_safety=allowed_safety):
+            posts.extend(post_batch)
+        return posts
+
+    async def iter_all_posts(self, minimum_score:int=None, allowed_safety:list[str]=None, batch_size:int=1000) -> AsyncIterator[list[resources.InternalPost]]:
+        """Reads the posts from the latest posts db export, yielding them in batches as the export is parsed
+
+        Deleted, pending and flagged posts are skipped, along with posts under the minimum score or outside the allowed safety,
+        before any post objects are created for them
+
+        Args:
+            minimum_score (int, optional): The minimum score of the posts to yield. Defaults to None.
+            allowed_safety (list[str], optional): The safety ratings of the posts to yield. Defaults to None.
+            batch_size (int, optional): The number of posts in each batch. Defaults to 1000.
 
-        with gzip.open(posts_export_archive, "rt") as posts_gz:
-            posts_csv_reader = csv.DictReader(posts_gz)
-            
-            for post in posts_csv_reader:
+        Yields:
+            list[resources.InternalPost]: The next batch of posts
+        """
+        posts_export_archive = await self._download_latest_db_export(filename_string="posts-")
+
+        async for post_rows in self._iter_db_export_batches(db_export_archive=posts_export_archive, batch_size=batch_size):
+            posts:list[resources.InternalPost] = []
 
+            for post in post_rows:
                 if post.get("is_deleted", "t") != "f":
                     continue
                 if post.get("is_pending", "t") != "f":
@@ -307,20 +378,44 @@ class E621Client(SharedAttributes, _plugin_template.ApiPlugin):
                 if post.get("is_flagged", "t") != "f":
                     continue
 
-                post_data = {
-                    "id": int(post["id"]),
-                    "created_at": datetime.fromisoformat(post["created_at"]),
-                    "updated_at": datetime.fromisoformat(post["updated_at"]),
-                    "md5": post["md5"],
-                    "source": post["source"].split("\n"),
-                    "rating": self.POST_SAFETY_MAPPING.get(post["rating"], "sketchy"),
-                    "tags": [{"names": [tag]} for tag in post["tag_string"].split(" ")],
-                    "description": post["description"]
-                } 
-
-                posts.append(resources.InternalPost.from_dict(post_data))
-        
-        return posts
+                score = int(post.get("score") or 0)
+                if minimum_score is not None and score < minimum_score:
+                    continue
+
+                safety = self.POST_SAFETY_MAPPING.get(post["rating"], constants.Safety._DEFAULT)
+                if allowed_safety is not None and safety not in allowed_safety:
+                    continue
+
+                posts.append(resources.InternalPost(
+                    id=int(post["id"]),
+                    created_at=datetime.fromisoformat(post["created_at"]),
+                    updated_at=datetime.fromisoformat(post["updated_at"]),
+                    md5=post["md5"],
+                    sources=[source for source in post["source"].split("\n") if source],
+                    safety=safety,
+                    score=score,
+                    tags=[resources.get_tag(name=tag) for tag in post["tag_string"].split(" ") if tag],
+                    description=post["description"],
+                    origin=self._NAME
+                ))
+
+            if posts:
+                yield posts
+
+    async def _iter_db_export_batches(self, db_export_archive:Path, batch_size:int) -> AsyncIterator[list[dict[str, str]]]:
+        # Decompressing and parsing the export is blocking, so each batch is read in a worker thread
+        batches = self._read_db_export_batches(db_export_archive=db_export_archive, batch_size=batch_size)
+        try:
+            while rows := await asyncio.to_thread(next, batches, None):
+                yield rows
+        finally:
+            batches.close()
+
+    def _read_db_export_batches(self, db_export_archive:Path, batch_size:int) -> Iterator[list[dict[str, str]]]:
+        with gzip.open(db_export_archive, "rt", newline="") as db_export_gz:
+            db_export_csv_reader = csv.DictReader(db_export_gz)
+            while rows := list(itertools.islice(db_export_csv_reader, batch_size)):
+                yield rows
     
     async def _download_latest_db_export(self, filename_string:str) -> Path|None:
         db_export_links = await self._get_db_export_links()
@@ -331,18 +426,94 @@ class E621Client(SharedAttributes, _plugin_template.ApiPlugin):
             if filename_string not in filename:
                 continue
 
+            local_file = await self._download_db_export(url=link, filename=filename)
+            self._remove_old_db_exports(filename_string=filename_string, latest_filename=filename)
+            return local_file
+        return None
+
+    async def _download_db_export(self, url:str, filename:str) -> Path:
+        """Downloads the db export into the export directory, streaming it to disk in chunks
+
+        A cached export for the same date is reused, and revalidated with its ETag/Last-Modified when they were saved.
+        An interrupted download is resumed with a Range request
+
+        Args:
+            url (str): The URL of the db export
+            filename (str): The filename of the db export, which includes the export date
+
+        Returns:
+            Path: The downloaded db export
+        """
+        db_export_directory = Path(self.db_export_directory)
+        db_export_directory.mkdir(parents=True, exist_ok=True)
+        local_file = db_export_directory / filename
+        partial_file = db_export_directory / f"{filename}.part"
+        validators_file = db_export_directory / f"{filename}.json"
+
+        validators:dict[str, str] = {}
+        if validators_file.exists():
+            validators = json.loads(validators_file.read_text())
+        has_validators = bool(validators.get("etag") or validators.get("last_modified"))
+
+        # Exports are named by their date, so a cached file is only revalidated when there's something to revalidate it with
+        if local_file.exists() and not has_validators:
+            logger.debug(f"Using cached db export '{local_file}'")
+            return local_file
+
+        # The second attempt restarts the download when the partial download is rejected
+        for attempt_count in range(1, 3):
+            headers = {}
+            if local_file.exists():
+                if validators.get("etag"):
+                    headers["If-None-Match"] = validators["etag"]
+                if validators.get("last_modified"):
+                    headers["If-Modified-Since"] = validators["last_modified"]
+            elif partial_file.exists() and has_validators:
+                headers["Range"] = f"bytes={partial_file.stat().st_size}-"
+                headers["If-Range"] = validators.get("etag") or validators["last_modified"]
+
             async with self.session.get(
-                url=link
+                url=url,
+                headers=headers
                 ) as response:
-                content = await response.content.read()
-            
-            local_file = self.create_tmp_directory() / filename
-            with open(local_file, "wb") as file:
-                file.write(content)
+                if response.status == 304:
+                    logger.debug(f"Using cached db export '{local_file}' as it's unchanged")
+                    return local_file
 
-            logger.debug(f"Downloaded db export '{filename}'")
+                if response.status == 416 and "Range" in headers and attempt_count == 1:
+                    logger.debug(f"Restarting the download of '{filename}' as the partial download is invalid")
+                    partial_file.unlink()
+                    continue
+
+                response.raise_for_status()
+
+                validators = {
+                    "etag": response.headers.get("ETag", ""),
+                    "last_modified": response.headers.get("Last-Modified", "")
+                }
+                validators_file.write_text(json.dumps(validators))
 
+                if response.status == 206:
+                    logger.info(f"Resuming the download of db export '{filename}' from {partial_file.stat().st_size} bytes")
+                    file_mode = "ab"
+                else:
+                    logger.info(f"Downloading db export '{filename}'")
+                    file_mode = "wb"
+
+                with open(partial_file, file_mode) as file:
+                    async for chunk in response.content.iter_chunked(self.db_export_chunk_size):
+                        file.write(chunk)
+
+            partial_file.replace(local_file)
+            logger.debug(f"Downloaded db export '{filename}'")
             return local_file
+
+    def _remove_old_db_exports(self, filename_string:str, latest_filename:str) -> None:
+        for file in Path(self.db_export_directory).glob(f"{filename_string}*"):
+            if file.name.startswith(latest_filename):
+                continue
+            logger.debug(f"Removing old db export '{file}'")
+            file.unlink()
         return None
 
     @alru_cache(ttl=120)
@@ -361,45 +532,6 @@ class E621Client(SharedAttributes, _plugin_template.ApiPlugin):
 
         return file_links
 
-    def _add_implication(self, tags:dict[str, resources.InternalTag], name:str, implication:str):
-        logger.debug(f"Adding implication '{implication}' to '{name}'")
-        try:
-            tag = tags[name]
-            if implication in tag.names:
-                logger.warning(f"Skipping implication '{implication}' as it already exists in names/aliases of '{name}'")
-                return tags
-            tag.implications.append(tags[implication])
-        except KeyError:
-            logger.debug(f"Skipping implication '{implication}' as the tag '{name}' or '{implication}' didn't exist")
-        return tags
-
-    def _add_alias(self, tags:dict[str, resources.InternalTag], name:str, alias:str):
-        logger.debug(f"Adding alias '{alias}' to '{name}'")
-        try:
-            tags[name].names.append(alias)
-        except KeyError:
-            logger.debug(f"Skipping alias '{alias}' as the tag '{name}' didn't exist")
-        return tags
-    
-    def _merge_tags(self, tags:dict[str, resources.InternalTag], from_name:str, to_name:str):
-        from_tag = tags.pop(from_name)
-        to_tag = tags[to_name]
-
-        for tag_name in from_tag.names:
-            if tag_name not in to_tag.names:
-                logger.debug(f"Adding name '{tag_name}' to '{to_name}'")
-                to_tag.names.append(tag_name)
-
-        for implication in from_tag.implications:
-            if not any(tag_name in implication.names for tag_name in to_tag.names):
-                logger.warning(f"Skipping implication '{implication}' as it already exists in names/aliases of '{to_name}'")
-                continue
-            to_tag.implications.append(implication)
-        
-        tags[from_name] = to_tag
-
-        return tags
-
 class E621Validator(SharedAttributes, _plugin_template.ValidationPlugin):
     POST_URL_PATTERN = re.compile(r"(https:\/\/[a-zA-Z0-9.-]+\/posts\/.+)|(https:\/\/[a-zA-Z0-9.-]+\/data\/sample\/.+)")
     GLOBAL_URL_PATTERN = re.compile(r"(https:\/\/[a-zA-Z0-9.-]+\/?$)")
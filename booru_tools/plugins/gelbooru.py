@@ -68,9 +68,7 @@ class GelbooruMeta(SharedAttributes, _plugin_template.MetadataPlugin):
 
         for tag in tags.split(" "):
             unescaped_tag = html.unescape(tag)
-            tag_resource = resources.InternalTag(
-                names=[unescaped_tag]
-            )
+            tag_resource = resources.get_tag(name=unescaped_tag)
             all_tags.append(tag_resource)
 
         return all_tags
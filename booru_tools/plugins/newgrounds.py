@@ -78,18 +78,13 @@ class NewgroundsMeta(SharedAttributes, _plugin_template.MetadataPlugin):
         all_tags:list[resources.InternalTag] = []
 
         for tag in artists:
-            tag = resources.InternalTag(
-                names=[tag],
-                category=constants.TagCategory.ARTIST
-            )
+            tag = resources.get_tag(name=tag, category=constants.TagCategory.ARTIST)
             all_tags.append(tag)
         
         for tag in str_tags:
             if tag in artists:
                 continue
-            tag = resources.InternalTag(
-                names=[tag]
-            )
+            tag = resources.get_tag(name=tag)
             all_tags.append(tag)
         
         return all_tags
@@ -1,11 +1,10 @@
-from dataclasses import dataclass, field, fields
+from dataclasses import dataclass, field, fields, asdict
 from typing import Optional, Literal, Type, Generic, TypeVar, ParamSpec, Callable, Awaitable, Any
 from pathlib import Path
 from datetime import datetime, timezone
 from loguru import logger
 from async_lru import alru_cache
-from aiolimiter import AsyncLimiter
-from copy import deepcopy
+from copy import copy, deepcopy
 import traceback
 
 import urllib.parse
@@ -15,7 +14,7 @@ import json
 import functools
 
 from booru_tools.plugins import _plugin_template
-from booru_tools.shared import resources, errors, constants
+from booru_tools.shared import resources, errors, constants, rate_limit
 
 class SzurubooruError(Exception):
     pass
@@ -212,12 +211,16 @@ class SzurubooruErrorHandler:
                     szurubooru_error_description = error_json.get("description")
                     szurubooru_error_class = self.ERROR_MAP[szurubooru_error_name]
                     message = f"HTTP Error {error.status}: '{szurubooru_error_name}' {szurubooru_error_description}"
-                    raise szurubooru_error_class(message)
+                    szurubooru_error = szurubooru_error_class(message)
+                    szurubooru_error.retry_after = errors.get_retry_after(error)
+                    raise szurubooru_error
                 except json.decoder.JSONDecodeError as e:
                     szurubooru_error_class = errors.HTTP_CODE_MAP.get(error.status, None)
                     if szurubooru_error_class:
                         logger.critical(f"Provided the arguments args='{args}' and kwargs='{kwargs}'")
-                        raise szurubooru_error_class(f"Failed to decode error message. Full response text is '{error.message}'")
+                        szurubooru_error = szurubooru_error_class(f"Failed to decode error message. Full response text is '{error.message}'")
+                        szurubooru_error.retry_after = errors.get_retry_after(error)
+                        raise szurubooru_error
                     logger.critical(f"Failed to decode error message. Full response text is '{error.message}'")
                     logger.critical(f"Provided the arguments args='{args}' and kwargs='{kwargs}'")
                     logger.critical(traceback.format_exc())
@@ -283,6 +286,25 @@ class ValidateUniquePostTags:
 
         return wrapper
 
+class InvalidateTagIndexOnError:
+    def __init__(self, tag_param:str="tag"):
+        self.tag_param = tag_param
+
+    def __call__(self, func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> R:
+            try:
+                return await func(*args, **kwargs)
+            except (IntegrityError, TagNotFoundError, TagAlreadyExistsError) as e:
+                func_self = args[0]
+                tag:resources.InternalTag = kwargs[self.tag_param]
+                if func_self.tag_index:
+                    logger.debug(f"Invalidating {tag.names} in the tag index due to '{e}'")
+                    func_self.tag_index.invalidate(names=tag.names)
+                raise e
+
+        return wrapper
+
 @dataclass(kw_only=True)
 class SzurubooruResource:
     @classmethod
@@ -425,6 +447,7 @@ class Tag(MicroTag):
 
         if self.version:
             kwargs["_extra"]["szurubooru"]["version"] = self.version
+        kwargs["_extra"]["szurubooru"]["usages"] = self.usages
 
         return resources.InternalTag(**kwargs)
 
@@ -602,6 +625,109 @@ class ImageSearch(Generic[T], SzurubooruResource):
 
         return cls(**data)
 
+class TagIndex:
+    """An in-memory index of every tag on the server, keyed by each of its names
+
+    Once the index is complete a name missing from it is treated as not existing on the server,
+    unless it was invalidated or seen on a post since the index was loaded
+    """
+    def __init__(self):
+        self.tags:dict[str, Tag] = {}
+        self.complete:bool = False
+        self.unknown_names:set[str] = set()
+        self.newest_creation_time:str = ""
+        self.newest_edit_time:str = ""
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    @property
+    def tag_count(self) -> int:
+        return len({id(tag) for tag in self.tags.values()})
+
+    def get(self, name:str) -> Tag|None:
+        return self.tags.get(name.lower(), None)
+
+    def clear(self) -> None:
+        self.tags = {}
+        self.unknown_names = set()
+        self.newest_creation_time = ""
+        self.newest_edit_time = ""
+        return None
+
+    def is_missing(self, name:str) -> bool:
+        """Checks if the index knows the tag name doesn't exist on the server
+
+        Args:
+            name (str): The tag name
+
+        Returns:
+            bool: True if the tag doesn't exist
+        """
+        name = name.lower()
+        if not self.complete or name in self.unknown_names:
+            return False
+        return name not in self.tags
+
+    def add(self, tag:Tag) -> None:
+        for name in tag.names:
+            existing_tag = self.tags.get(name.lower(), None)
+            if existing_tag and existing_tag is not tag:
+                self.remove(tag=existing_tag)
+
+        for name in tag.names:
+            self.tags[name.lower()] = tag
+            self.unknown_names.discard(name.lower())
+
+        if tag.creationTime and tag.creationTime > self.newest_creation_time:
+            self.newest_creation_time = tag.creationTime
+        if tag.lastEditTime and tag.lastEditTime > self.newest_edit_time:
+            self.newest_edit_time = tag.lastEditTime
+        return None
+
+    def remove(self, tag:Tag) -> None:
+        for name in tag.names:
+            indexed_tag = self.tags.get(name.lower(), None)
+            if indexed_tag and indexed_tag.names[0] == tag.names[0]:
+                del self.tags[name.lower()]
+        return None
+
+    def invalidate(self, names:list[str]) -> None:
+        """Drops the names from the index, so they're looked up on the server next time
+
+        Args:
+            names (list[str]): The tag names to drop
+        """
+        for name in names:
+            name = name.lower()
+            if tag := self.tags.get(name, None):
+                self.remove(tag=tag)
+                self.unknown_names.update(tag_name.lower() for tag_name in tag.names)
+            self.unknown_names.add(name)
+        return None
+
+    def save(self, file:Path) -> None:
+        unique_tags = {id(tag): tag for tag in self.tags.values()}.values()
+        data = {
+            "newest_creation_time": self.newest_creation_time,
+            "newest_edit_time": self.newest_edit_time,
+            "tags": [asdict(tag) for tag in unique_tags]
+        }
+        logger.debug(f"Saving {len(data['tags'])} tags to the tag index file '{file}'")
+        with open(file, "w") as json_file:
+            json.dump(data, json_file)
+        return None
+
+    def load(self, file:Path) -> None:
+        logger.debug(f"Loading the tag index file '{file}'")
+        with open(file, "r") as json_file:
+            data = json.load(json_file)
+
+        for tag_data in data["tags"]:
+            self.add(tag=Tag.from_dict(tag_data))
+        self.newest_creation_time = data.get("newest_creation_time", self.newest_creation_time)
+        self.newest_edit_time = data.get("newest_edit_time", self.newest_edit_time)
+        return None
 
 class SharedAttributes:
     _DOMAINS = []
@@ -633,24 +759,54 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
         self.image_distance_threshold = 0.10
         self.create_sql_fixes = False
         self.force_source_check = False
-        self.rate_limiter = AsyncLimiter(
-            max_rate=200,
-            time_period=60
-        )
-        self.medium_rate_limiter = AsyncLimiter(
-            max_rate=5,
-            time_period=20
-        )
-        self.heavy_rate_limiter = AsyncLimiter(
-            max_rate=1,
-            time_period=60
-        )
+        self.bulk_search_size = 100
+        self.tag_index_workers = 8
+        self.preload_tag_index = False
+        self.tag_index_file:Path = None
+        self.tag_index:TagIndex = None
+        self._tag_index_lock = asyncio.Lock()
+        self.rate_limit:dict = {}
+        self._rate_limiter:rate_limit.AdaptiveRateLimiter = None
+        self.upload_limit:dict = {}
+        self._upload_scheduler:rate_limit.UploadScheduler = None
+        self.post_create_rate_limit:dict = {}
+        self._medium_rate_limiter:rate_limit.AdaptiveRateLimiter = None
 
         self.sql_fixes_file = Path("szurubooru_fixes.sql")
         # if self.create_sql_fixes and self.sql_fixes_file.exists():
         #     logger.info(f"Blanking '{self.sql_fixes_file.absolute()}' as it exists")
         #     open(self.sql_fixes_file, 'w').close()
     
+    @property
+    def rate_limiter(self) -> rate_limit.AdaptiveRateLimiter:
+        # Created on first use, as the plugin config is applied after __init__
+        if not self._rate_limiter:
+            self._rate_limiter = rate_limit.AdaptiveRateLimiter(name="szurubooru", **self.rate_limit)
+            logger.debug(f"Created rate limiter {self._rate_limiter}")
+        return self._rate_limiter
+
+    @property
+    def medium_rate_limiter(self) -> rate_limit.AdaptiveRateLimiter:
+        # Post creation is much heavier on the server than other requests, so it's limited separately
+        if not self._medium_rate_limiter:
+            rate_limit_config = {
+                "initial_rate": 0.25,
+                "max_rate": 1.0,
+                "initial_concurrency": 2,
+                "max_concurrency": 4,
+                **self.post_create_rate_limit
+            }
+            self._medium_rate_limiter = rate_limit.AdaptiveRateLimiter(name="szurubooru post creation", **rate_limit_config)
+            logger.debug(f"Created rate limiter {self._medium_rate_limiter}")
+        return self._medium_rate_limiter
+
+    @property
+    def upload_scheduler(self) -> rate_limit.UploadScheduler:
+        if not self._upload_scheduler:
+            self._upload_scheduler = rate_limit.UploadScheduler(name="szurubooru uploads", **self.upload_limit)
+            logger.debug(f"Created upload scheduler {self._upload_scheduler}")
+        return self._upload_scheduler
+
     @property
     def token(self):
         token = self.encode_auth_headers(self.username, self.password)
@@ -661,8 +817,52 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
         headers = {"Accept": "application/json", "Authorization": f"Token {self.token}"}
         return headers
 
-    async def find_exact_post(self, post:resources.InternalPost) -> resources.InternalPost | None:
-        if post.md5:
+    async def find_exact_posts(self, posts:list[resources.InternalPost]) -> dict[str, resources.InternalPost]:
+        """Finds the existing posts for a batch of posts with as few searches as possible
+
+        szurubooru accepts comma seperated values for a search key, so each search resolves up to 'bulk_search_size' hashes
+
+        Args:
+            posts (list[resources.InternalPost]): The posts to find
+
+        Returns:
+            dict[str, resources.InternalPost]: The found posts keyed by both their md5 and sha1 hashes
+        """
+        found_posts:dict[str, resources.InternalPost] = {}
+
+        md5_hashes = list({post.md5 for post in posts if post.md5})
+        found_posts.update(
+            await self._find_posts_from_hashes(search_key="md5", hashes=md5_hashes)
+        )
+
+        sha1_hashes = list({post.sha1 for post in posts if post.sha1 and post.md5 not in found_posts and post.sha1 not in found_posts})
+        found_posts.update(
+            await self._find_posts_from_hashes(search_key="sha1", hashes=sha1_hashes)
+        )
+
+        logger.debug(f"Found {len(set(post.id for post in found_posts.values()))} existing posts for {len(posts)} posts")
+        return found_posts
+
+    async def _find_posts_from_hashes(self, search_key:str, hashes:list[str]) -> dict[str, resources.InternalPost]:
+        found_posts:dict[str, resources.InternalPost] = {}
+
+        for index in range(0, len(hashes), self.bulk_search_size):
+            hashes_chunk = hashes[index:index + self.bulk_search_size]
+            search_query = f"{search_key}:{','.join(hashes_chunk)}"
+            post_search = await self._post_search(
+                search_query=search_query,
+                search_size=len(hashes_chunk)
+            )
+            
+            for found_post in post_search.results:
+                found_resource = found_post.to_resource()
+                found_posts[found_post.checksumMD5] = found_resource
+                found_posts[found_post.checksum] = found_resource
+        
+        return found_posts
+
+    async def find_exact_post(self, post:resources.InternalPost, check_hashes:bool=True) -> resources.InternalPost | None:
+        if check_hashes and post.md5:
             search_query = f"md5:{post.md5}"
             post_search = await self._post_search(
                 search_query=search_query,
@@ -677,7 +877,7 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
             except IndexError:
                 logger.debug(f"Post not found with md5: {post.md5}")
         
-        if post.sha1:
+        if check_hashes and post.sha1:
             search_query = f"sha1:{post.sha1}"
             post_search = await self._post_search(
                 search_query=search_query,
@@ -754,8 +954,10 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
                 return found_tag
         return None
     
-    async def get_all_tags(self) -> list[resources.InternalTag]:
-        raise NotImplementedError
+    async def get_all_tags(self, treat_aliases_as_implications:bool=False) -> list[resources.InternalTag]:
+        tag_index = await self.load_tag_index()
+        unique_tags = {id(tag): tag for tag in tag_index.tags.values()}.values()
+        return [tag.to_resource() for tag in unique_tags]
     
     async def get_all_pools(self) -> list[resources.InternalPool]:
         raise NotImplementedError
@@ -766,9 +968,13 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
         retry_limit=6
     )
     @errors.log_all_errors
+    @InvalidateTagIndexOnError(tag_param="tag")
     async def push_tag(self, tag:resources.InternalTag, replace_tags:bool=False, create_empty_tags:bool=True) -> resources.InternalTag:       
         # Work around as szurubooru returns a 500 error if tag names exceed 190 names
-        tag.names = tag.names[:189]
+        if len(tag.names) > 189:
+            # The tag may be interned and shared with other posts, so only its copy is truncated
+            tag = copy(tag)
+            tag.names = tag.names[:189]
         
         conflicting_tags = await self._get_conflicting_tags(
             names=tag.names,
@@ -861,18 +1067,59 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         return new_tag.to_resource()
 
+    async def create_tag(self, tag:resources.InternalTag) -> resources.InternalTag:
+        new_tag = await self._create_tag(tag=tag)
+        return new_tag.to_resource()
+
+    async def update_tag(self, tag:resources.InternalTag) -> resources.InternalTag:
+        updated_tag = await self._update_tag(tag=tag)
+        return updated_tag.to_resource()
+
+    async def merge_tag(self, from_tag:resources.InternalTag, to_tag:resources.InternalTag) -> resources.InternalTag:
+        merged_tag = await self._merge_tag(
+            from_tag=self._tag_from_resource(tag=from_tag),
+            to_tag=self._tag_from_resource(tag=to_tag)
+        )
+        return merged_tag.to_resource()
+
+    async def delete_tag(self, tag:resources.InternalTag) -> None:
+        await self._delete_tag(tag=self._tag_from_resource(tag=tag))
+        return None
+
+    def _tag_from_resource(self, tag:resources.InternalTag) -> Tag:
+        tag_extra:dict = tag._extra[self._NAME]
+        return Tag(
+            names=tag.names,
+            category=tag.category,
+            version=tag_extra["version"],
+            usages=tag_extra.get("usages", 0)
+        )
+
     @errors.log_all_errors
-    async def push_post(self, post:resources.InternalPost, force_update:bool=False) -> resources.InternalPost:
+    async def push_post(self, post:resources.InternalPost, force_update:bool=False, exact_post:resources.InternalPost=None, check_exact_post:bool=True) -> resources.InternalPost:
+        """Creates or updates the post on szurubooru
+
+        Args:
+            post (resources.InternalPost): The post to push
+            force_update (bool, optional): Unused. Defaults to False.
+            exact_post (resources.InternalPost, optional): The existing post on szurubooru, if it's already known. Defaults to None.
+            check_exact_post (bool, optional): Whether to search for the existing post, set this to False when 'exact_post'
+                was already resolved (even to None) with find_exact_posts. Defaults to True.
+
+        Returns:
+            resources.InternalPost: The created or updated post
+        """
         merge_ignored_fields = [
             "id",
             "category",
             "deleted"
         ]
 
-        try:
-            exact_post = await self.find_exact_post(post=post)
-        except PostNotFoundError as error:
-            logger.debug(f"Post not found")
+        if check_exact_post and not exact_post:
+            try:
+                exact_post = await self.find_exact_post(post=post)
+            except PostNotFoundError as error:
+                logger.debug(f"Post not found")
 
         if post.local_file and not exact_post:
             try:
@@ -900,6 +1147,10 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
             self._generate_sql_fixes(post=desired_post)
             return new_post.to_resource()
         
+        if not exact_post:
+            logger.warning(f"Skipping '{post.id}' as it has no local file and no existing post was found to update")
+            return None
+
         logger.debug(f"No local file found. Updating post metadata with id={exact_post.id}")
         
         desired_post:resources.InternalPost = exact_post.merge_resource(update_object=post, fields_to_ignore=merge_ignored_fields)
@@ -921,7 +1172,7 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
         
         if not proposed_changes:
             logger.debug(f"No changes found in post ({exact_post.id})")
-            return None
+            return exact_post
         
         logger.debug(f"Changes found in post ({post.id}): {proposed_changes}")
         updated_post = await self._update_post(
@@ -963,11 +1214,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Searching for posts with query '{search_query}'")
 
-        async with self.session.get(
+        async with self.rate_limiter.request(endpoint="search"), self.session.get(
                 url=url,
                 headers=self.headers,
                 params=params
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -995,11 +1246,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Searching for tags with query '{search_query}'")
 
-        async with self.session.get(
+        async with self.rate_limiter.request(endpoint="search"), self.session.get(
                 url=url,
                 headers=self.headers,
                 params=params
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -1027,17 +1278,119 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Searching for pools with query '{search_query}'")
 
-        async with self.session.get(
+        async with self.rate_limiter.request(endpoint="search"), self.session.get(
                 url=url,
                 headers=self.headers,
                 params=params
-            ) as response, self.rate_limiter:
+            ) as response:
             response_json = await response.json()
 
         pool_search:PagedSearch[Pool] = PagedSearch.from_dict(data=response_json, resource_type=Pool)
         
         return pool_search
 
+    async def load_tag_index(self) -> TagIndex:
+        """Loads every tag on the server into the tag index, so tag lookups don't need a request each
+
+        When a tag index file exists, only the tags created or edited since it was saved are requested.
+        If the index then holds a different number of tags than the server, tags were deleted or merged away
+        since it was saved, so every tag is downloaded again
+
+        Returns:
+            TagIndex: The loaded tag index
+        """
+        async with self._tag_index_lock:
+            if self.tag_index and self.tag_index.complete:
+                return self.tag_index
+
+            tag_index = TagIndex()
+            if self.tag_index_file and Path(self.tag_index_file).exists():
+                tag_index.load(file=Path(self.tag_index_file))
+                await self._refresh_tag_index(tag_index=tag_index)
+            else:
+                await self._download_tag_index(tag_index=tag_index)
+
+            tag_index.complete = True
+            self.tag_index = tag_index
+            logger.info(f"Loaded {len(tag_index)} tag names into the tag index")
+
+            if self.tag_index_file:
+                self.save_tag_index()
+        
+        return self.tag_index
+
+    def save_tag_index(self) -> None:
+        if not self.tag_index or not self.tag_index_file:
+            return None
+        self.tag_index.save(file=Path(self.tag_index_file))
+        return None
+
+    async def _download_tag_index(self, tag_index:TagIndex) -> TagIndex:
+        search_query = "sort:creation-time,asc"
+        first_page = await self._tag_search(search_query=search_query, search_size=self.bulk_search_size)
+        logger.info(f"Downloading {first_page.total} tags into the tag index")
+
+        for tag in first_page.results:
+            tag_index.add(tag=tag)
+
+        # A fixed number of workers take the remaining pages in turn, adding each page to the index as it arrives
+        offsets = range(self.bulk_search_size, first_page.total, self.bulk_search_size)
+        pending_offsets = iter(offsets)
+
+        async def download_pages() -> None:
+            for offset in pending_offsets:
+                page = await self._tag_search(search_query=search_query, search_size=self.bulk_search_size, offset=offset)
+                for tag in page.results:
+                    tag_index.add(tag=tag)
+            return None
+
+        async with asyncio.TaskGroup() as task_group:
+            for _ in range(min(self.tag_index_workers, len(offsets))):
+                task_group.create_task(download_pages())
+        return tag_index
+
+    async def _refresh_tag_index(self, tag_index:TagIndex) -> TagIndex:
+        sort_watermarks = {
+            "creation-time": ("creationTime", tag_index.newest_creation_time),
+            "last-edit-time": ("lastEditTime", tag_index.newest_edit_time)
+        }
+
+        server_tag_count = None
+        for sort_key, (time_attribute, watermark) in sort_watermarks.items():
+            offset = 0
+            while True:
+                page = await self._tag_search(search_query=f"sort:{sort_key},desc", search_size=self.bulk_search_size, offset=offset)
+                server_tag_count = page.total
+                newer_tags = [tag for tag in page.results if (getattr(tag, time_attribute) or "") > watermark]
+
+                logger.debug(f"Found {len(newer_tags)} tags with a newer {time_attribute} than '{watermark}'")
+                for tag in newer_tags:
+                    tag_index.add(tag=tag)
+
+                offset += self.bulk_search_size
+                if len(newer_tags) < len(page.results) or offset >= page.total:
+                    break
+
+        if tag_index.tag_count != server_tag_count:
+            logger.info(f"The tag index has {tag_index.tag_count} tags but the server has {server_tag_count}, downloading every tag again")
+            tag_index.clear()
+            await self._download_tag_index(tag_index=tag_index)
+        return tag_index
+
+    async def _get_tag(self, tag:str) -> Tag|None:
+        if self.preload_tag_index:
+            tag_index = await self.load_tag_index()
+            if indexed_tag := tag_index.get(tag):
+                return indexed_tag
+            if tag_index.is_missing(tag):
+                raise TagNotFoundError(f"Tag '{tag}' is not in the tag index")
+
+        # alru_cache shares a single in-flight request between concurrent callers asking for the same name
+        found_tag = await self._fetch_tag(tag=tag)
+        if self.tag_index and found_tag:
+            self.tag_index.add(tag=found_tag)
+        return found_tag
+
     @alru_cache(maxsize=1024, ttl=15)
     @errors.RetryOnExceptions(
         exceptions=[errors.GatewayTimeout],
@@ -1045,13 +1398,13 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
         retry_limit=6
     )
     @SzurubooruErrorHandler()
-    async def _get_tag(self, tag:str) -> Tag|None:
+    async def _fetch_tag(self, tag:str) -> Tag|None:
         safe_tag = urllib.parse.quote(tag)
         url = f"{self.URL_BASE}/api/tag/{safe_tag}"
 
         logger.debug(f"Getting tag '{tag}'")
 
-        async with self.session.get(
+        async with self.rate_limiter.request(endpoint="tag"), self.session.get(
                 url=url,
                 headers=self.headers,
             ) as response:
@@ -1092,11 +1445,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Creating tag '{tag.names[0]}' with data={[tag]}")
 
-        async with self.session.post(
+        async with self.rate_limiter.request(endpoint="tag write"), self.session.post(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -1105,6 +1458,8 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
             response_json = await response.json()
         
         tag = Tag.from_dict(response_json)
+        if self.tag_index:
+            self.tag_index.add(tag=tag)
 
         return tag
 
@@ -1134,11 +1489,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Attempting to update tag '{tag.names[0]}' with data={[tag]}")
 
-        async with self.session.put(
+        async with self.rate_limiter.request(endpoint="tag write"), self.session.put(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -1146,9 +1501,12 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
                 raise err
             response_json = await response.json()
 
-        tag = Tag.from_dict(response_json)
+        updated_tag = Tag.from_dict(response_json)
+        if self.tag_index:
+            self.tag_index.invalidate(names=tag.names)
+            self.tag_index.add(tag=updated_tag)
 
-        return tag
+        return updated_tag
 
     @errors.RetryOnExceptions(
         exceptions=[errors.GatewayTimeout],
@@ -1166,11 +1524,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Attempting to delete tag '{tag.names[0]}' with version {tag.version}")
 
-        async with self.session.delete(
+        async with self.rate_limiter.request(endpoint="tag write"), self.session.delete(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -1178,6 +1536,9 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
                 raise err
             response_json = await response.json()
         
+        if self.tag_index:
+            self.tag_index.remove(tag=tag)
+
         return None
 
     @errors.RetryOnExceptions(
@@ -1201,11 +1562,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Attempting to merge tag '{from_tag_name}' [v{from_tag.version}] into {to_tag_name} [v{to_tag.version}]")
 
-        async with self.session.post(
+        async with self.rate_limiter.request(endpoint="tag write"), self.session.post(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response_json = await response.json()
                 response.raise_for_status()
@@ -1214,6 +1575,9 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
                 raise err
 
         tag = Tag.from_dict(response_json)
+        if self.tag_index:
+            self.tag_index.remove(tag=from_tag)
+            self.tag_index.add(tag=tag)
 
         return tag
     
@@ -1227,13 +1591,14 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
         conflicting_tags:list[Tag] = []
         all_found_names:set[str] = set()
 
+        found_tags = await self._get_tags_by_names(names=names)
+
         for name in names:
             if name in all_found_names:
                 continue
 
-            try:
-                found_tag:Tag = await self._get_tag(tag=name)
-            except TagNotFoundError:
+            found_tag:Tag = found_tags.get(name, None)
+            if not found_tag:
                 continue
 
             found_tag_names = set(found_tag.names)
@@ -1249,6 +1614,56 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         return conflicting_tags
     
+    async def _get_tags_by_names(self, names:list[str]) -> dict[str, Tag]:
+        """Gets the tags for each name, looking up the names concurrently
+
+        The first name is looked up on its own, so its aliases don't need a request each
+
+        Args:
+            names (list[str]): The tag names to look up
+
+        Returns:
+            dict[str, Tag]: The found tags keyed by the name they were found with
+        """
+        found_tags:dict[str, Tag] = {}
+        if not names:
+            return found_tags
+
+        async def get_tag_or_none(name:str) -> Tag|None:
+            try:
+                return await self._get_tag(tag=name)
+            except TagNotFoundError:
+                return None
+
+        first_tag = await get_tag_or_none(names[0])
+        if first_tag:
+            found_tags[names[0]] = first_tag
+        first_tag_names = set(first_tag.names) if first_tag else set()
+
+        remaining_names = [name for name in dict.fromkeys(names[1:]) if name not in first_tag_names]
+        async with asyncio.TaskGroup() as task_group:
+            tag_tasks = {
+                name: task_group.create_task(get_tag_or_none(name))
+                for name in remaining_names
+            }
+
+        for name, task in tag_tasks.items():
+            if found_tag := task.result():
+                found_tags[name] = found_tag
+
+        return found_tags
+
+    def _invalidate_new_post_tags(self, post:Post) -> None:
+        """Drops tags szurubooru created implicitly for the post from the tag index, so they're looked up on the server next time
+
+        Args:
+            post (Post): The post returned by the server
+        """
+        for micro_tag in post.tags or []:
+            if not self.tag_index.get(micro_tag.names[0]):
+                self.tag_index.invalidate(names=micro_tag.names)
+        return None
+
     def _correct_first_tag(self, primary_tag_name:str, tag:Tag|resources.InternalTag) -> Tag|resources.InternalTag:
         logger.error(f"First tag does not exist, moving primary tag '{primary_tag_name}' to first tag of {tag.names}")
         index_of_primary_tag = tag.names.index(primary_tag_name)
@@ -1288,11 +1703,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Creating post with data={data}")
 
-        async with self.session.post(
+        async with self.medium_rate_limiter.request(), self.session.post(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.medium_rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -1301,6 +1716,8 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
             response_json = await response.json()
 
         post = Post.from_dict(response_json)
+        if self.tag_index:
+            self._invalidate_new_post_tags(post=post)
 
         return post
 
@@ -1334,11 +1751,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Updating post '{post.id}' with data={data}")
 
-        async with self.session.put(
+        async with self.rate_limiter.request(endpoint="post write"), self.session.put(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -1347,6 +1764,8 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
             response_json = await response.json()
 
         post = Post.from_dict(response_json)
+        if self.tag_index:
+            self._invalidate_new_post_tags(post=post)
 
         return post
     
@@ -1426,30 +1845,25 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         timeout = aiohttp.ClientTimeout(total=300)
 
-        if file_size < 500000:
-            chosen_rate_limiter = self.rate_limiter
-        elif file_size < 250000000:
-            chosen_rate_limiter = self.medium_rate_limiter
-        else:
-            chosen_rate_limiter = self.heavy_rate_limiter
-
-        with open(file, "rb") as file_content:
-            form = aiohttp.FormData()
-            form.add_field("content", file_content, filename=file.name)
-
-            async with self.session.post(
-                    url=url,
-                    headers=self.headers,
-                    data=form,
-                    timeout=timeout
-                ) as response, chosen_rate_limiter:
-                response_json = await response.json()
-                logger.info(f"Uploaded file '{file}' to temporary endpoint")
-                try:
-                    response.raise_for_status()
-                except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
-                    err.message = await response.text()
-                    raise err
+        # Admitted before the file is opened, so queued uploads don't hold file handles or count against the timeout
+        async with self.upload_scheduler.upload(file_size=file_size):
+            with open(file, "rb") as file_content:
+                form = aiohttp.FormData()
+                form.add_field("content", file_content, filename=file.name)
+
+                async with self.session.post(
+                        url=url,
+                        headers=self.headers,
+                        data=form,
+                        timeout=timeout
+                    ) as response:
+                    response_json = await response.json()
+                    logger.info(f"Uploaded file '{file}' to temporary endpoint")
+                    try:
+                        response.raise_for_status()
+                    except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
+                        err.message = await response.text()
+                        raise err
 
         token:str = response_json["token"]
         
@@ -1471,11 +1885,11 @@ class SzurubooruClient(SharedAttributes, _plugin_template.ApiPlugin):
 
         logger.debug(f"Reverse image search with data={data}")
 
-        async with self.session.post(
+        async with self.rate_limiter.request(endpoint="image search"), self.session.post(
                 url=url,
                 headers=self.headers,
                 json=data
-            ) as response, self.rate_limiter:
+            ) as response:
             try:
                 response.raise_for_status()
             except (aiohttp.ClientResponseError, aiohttp.ContentTypeError) as err:
@@ -13,6 +13,7 @@ class DefaultCoreConfig(DefaultConfigBaseGroup):
     allowed_safety:list = field(default_factory=lambda: ["safe", "sketchy", "unsafe"])
     minimum_score:int = field(default=10)
     destination:str = field(default="szurubooru")
+    import_state_file:Path = field(default=Path("import_state.sqlite"))
 
 ### Commands
 @dataclass(kw_only=True)
@@ -35,10 +36,20 @@ class DefaultCommandsConfig(DefaultConfigBaseGroup):
 class DefaultDownloadersGalleryDlConfig(DefaultConfigBaseGroup):
     page_size:int = field(default=50)
     extra_params:list = field(default_factory=list)
+    max_processes:int = field(default=4)
+    streaming:bool = field(default=False)
+    native_media_download:bool = field(default=False)
+    max_media_downloads:int = field(default=4)
+
+@dataclass(kw_only=True)
+class DefaultDownloadersMediaCacheConfig(DefaultConfigBaseGroup):
+    directory:Path = field(default=Path("media_cache"))
+    max_size:int = field(default=0) # The cache size limit in bytes, 0 disables the cache
 
 @dataclass(kw_only=True)
 class DefaultDownloadersConfig(DefaultConfigBaseGroup):
     gallery_dl:DefaultDownloadersGalleryDlConfig = field(default_factory=DefaultDownloadersGalleryDlConfig)
+    media_cache:DefaultDownloadersMediaCacheConfig = field(default_factory=DefaultDownloadersMediaCacheConfig)
 
 ### Networking
 @dataclass(kw_only=True)
@@ -47,6 +58,36 @@ class DefaultNetworkingConfig(DefaultConfigBaseGroup):
     cookies_file:Path = field(default=Path("cookies.txt"))
 
 ### Plugins
+@dataclass(kw_only=True)
+class DefaultPluginsRateLimitConfig(DefaultConfigBaseGroup):
+    initial_rate:float = field(default=3.0) # Requests per second
+    min_rate:float = field(default=0.1)
+    max_rate:float = field(default=50.0)
+    initial_concurrency:int = field(default=4)
+    min_concurrency:int = field(default=1)
+    max_concurrency:int = field(default=32)
+    additive_increase:float = field(default=0.5)
+    decrease_factor:float = field(default=0.5)
+    window_size:int = field(default=20)
+    latency_factor:float = field(default=2.0)
+    baseline_weight:float = field(default=0.2)
+    adaptive:bool = field(default=True)
+
+@dataclass(kw_only=True)
+class DefaultPluginsPostCreateRateLimitConfig(DefaultPluginsRateLimitConfig):
+    initial_rate:float = field(default=0.25) # Requests per second
+    max_rate:float = field(default=1.0)
+    initial_concurrency:int = field(default=2)
+    max_concurrency:int = field(default=4)
+
+@dataclass(kw_only=True)
+class DefaultPluginsUploadLimitConfig(DefaultConfigBaseGroup):
+    bytes_per_second:float = field(default=20_000_000)
+    max_uploads:int = field(default=4)
+    heavy_threshold:int = field(default=250_000_000) # Files of this many bytes or more use the heavy lane
+    heavy_bytes_per_second:float = field(default=10_000_000)
+    max_heavy_uploads:int = field(default=1)
+
 @dataclass(kw_only=True)
 class DefaultPluginsSzurubooruConfig(DefaultConfigBaseGroup):
     username:str = field(default=None)
@@ -54,10 +95,20 @@ class DefaultPluginsSzurubooruConfig(DefaultConfigBaseGroup):
     URL_BASE:str = field(default=None)
     create_sql_fixes:bool = field(default=False)
     force_source_check:bool = field(default=True)
+    preload_tag_index:bool = field(default=False)
+    tag_index_file:Path = field(default=None)
+    rate_limit:DefaultPluginsRateLimitConfig = field(default_factory=DefaultPluginsRateLimitConfig)
+    post_create_rate_limit:DefaultPluginsPostCreateRateLimitConfig = field(default_factory=DefaultPluginsPostCreateRateLimitConfig)
+    upload_limit:DefaultPluginsUploadLimitConfig = field(default_factory=DefaultPluginsUploadLimitConfig)
+
+@dataclass(kw_only=True)
+class DefaultPluginsE621Config(DefaultConfigBaseGroup):
+    db_export_directory:Path = field(default=Path("e621_db_export"))
 
 @dataclass(kw_only=True)
 class DefaultPluginsConfig(DefaultConfigBaseGroup):
     szurubooru:DefaultPluginsSzurubooruConfig = field(default_factory=DefaultPluginsSzurubooruConfig)
+    e621:DefaultPluginsE621Config = field(default_factory=DefaultPluginsE621Config)
 
 ### Default Config
 @dataclass(kw_only=True)
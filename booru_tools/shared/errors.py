@@ -1,8 +1,15 @@
 from typing import TypeVar, ParamSpec, Callable, Awaitable, Any
+from datetime import datetime, timezone
+from urllib.parse import urlparse
 from loguru import logger
+import email.utils
+import contextvars
 import asyncio
+import aiohttp
 import functools
 import traceback
+import random
+import time
 
 class InvalidTagCategory(Exception):
     pass
@@ -19,6 +26,12 @@ class PostExists(Exception):
 class MissingFile(Exception):
     pass
 
+class HashMismatch(Exception):
+    pass
+
+class CircuitOpenError(Exception):
+    pass
+
 ### HTTP errors
 
 class ContentTooLarge(Exception):
@@ -36,6 +49,15 @@ class ServiceUnavailable(Exception):
 class GatewayTimeout(Exception):
     pass
 
+HOST_FAILURE_EXCEPTIONS = (
+    InternalServerError,
+    ServiceUnavailable,
+    GatewayTimeout,
+    TooManyRequestsError,
+    asyncio.TimeoutError,
+    aiohttp.ClientConnectionError
+)
+
 HTTP_CODE_MAP = {
     413: ContentTooLarge,
     429: TooManyRequestsError,
@@ -60,26 +82,242 @@ def log_all_errors(func: Callable[P, Awaitable[R]], reraise_errors:bool=False) -
                 raise error
     return wrapper
 
+class RetryBudget:
+    """A per-host budget of retries, each retry spends a token and each success earns back 'token_ratio' of one
+    """
+    def __init__(self, max_tokens:float=20, token_ratio:float=0.1):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def record_success(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.token_ratio)
+        return None
+
+class CircuitBreaker:
+    """Stops calls to a host after 'failure_threshold' consecutive failures, letting a single trial call through every 'reset_timeout' seconds
+    """
+    def __init__(self, host:str, failure_threshold:int=5, reset_timeout:float=30):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self.opened_at:float = None
+        self.trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self) -> bool:
+        """Checks the circuit before a call, raising CircuitOpenError if the call isn't allowed
+
+        Returns:
+            bool: Whether the call is the trial call, which must be ended with a record or end_trial
+        """
+        if not self.is_open:
+            return False
+        if self.trial_in_progress or (time.monotonic() - self.opened_at) < self.reset_timeout:
+            raise CircuitOpenError(f"Circuit for '{self.host}' is open after {self.failure_count} consecutive failures")
+        logger.info(f"Letting a trial call through to '{self.host}'")
+        self.trial_in_progress = True
+        return True
+
+    def end_trial(self) -> None:
+        # Frees the trial slot when the trial call ended without telling us whether the host is healthy
+        self.trial_in_progress = False
+        return None
+
+    def record_success(self) -> None:
+        if self.is_open:
+            logger.info(f"Closing circuit for '{self.host}' as the trial call succeeded")
+        self.failure_count = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        return None
+
+    def record_failure(self) -> None:
+        self.failure_count += 1
+        self.trial_in_progress = False
+        if self.is_open or self.failure_count >= self.failure_threshold:
+            if not self.is_open:
+                logger.warning(f"Opening circuit for '{self.host}' after {self.failure_count} consecutive failures")
+            self.opened_at = time.monotonic()
+        return None
+
+_retry_budgets:dict[str, RetryBudget] = {}
+_circuit_breakers:dict[str, CircuitBreaker] = {}
+
+class _RetriedCall:
+    """A running call of a RetryOnExceptions wrapped function, linked to the retried call it was made from
+    """
+    def __init__(self, host:str, parent:"_RetriedCall"=None):
+        self.host = host
+        self.parent = parent
+        self.is_trial:bool = False
+        self.made_nested_call:bool = False # Set when the current attempt made a retried call to the same host
+
+    def get_host_parent(self) -> "_RetriedCall|None":
+        parent = self.parent
+        while parent and parent.host != self.host:
+            parent = parent.parent
+        return parent
+
+    def is_within_trial(self) -> bool:
+        parent = self.get_host_parent()
+        while parent:
+            if parent.is_trial:
+                return True
+            parent = parent.parent
+        return False
+
+_current_retried_call:contextvars.ContextVar[_RetriedCall|None] = contextvars.ContextVar("current_retried_call", default=None)
+
+def get_retry_budget(host:str) -> RetryBudget:
+    if host not in _retry_budgets:
+        _retry_budgets[host] = RetryBudget()
+    return _retry_budgets[host]
+
+def get_circuit_breaker(host:str) -> CircuitBreaker:
+    if host not in _circuit_breakers:
+        _circuit_breakers[host] = CircuitBreaker(host=host)
+    return _circuit_breakers[host]
+
+def parse_retry_after(value:str|None) -> float|None:
+    """Parses a Retry-After header, given either as seconds or as a HTTP date
+
+    Args:
+        value (str|None): The header value
+
+    Returns:
+        float|None: The number of seconds to wait, or None if there's no valid value
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_time - datetime.now(timezone.utc)).total_seconds())
+
+def get_retry_after(error:Exception) -> float|None:
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    headers = getattr(error, "headers", None)
+    if headers:
+        return parse_retry_after(headers.get("Retry-After"))
+    return None
+
 class RetryOnExceptions:
-    def __init__(self, exceptions:list[Exception]=[GatewayTimeout, ServiceUnavailable, TooManyRequestsError], wait_time:int=30, retry_limit:int=6):
-        self.wait_time = wait_time
+    """Retries the function on the given exceptions with exponential backoff and full jitter, honouring Retry-After
+
+    Retries spend from a per-host retry budget and every attempt goes through a per-host circuit breaker,
+    both of which fail fast instead of retrying once the host looks down. This applies to wrapped calls nested in
+    other wrapped calls too, nested calls made by the trial call are part of the trial. A host failure is only
+    recorded on the breaker by the attempt it came from, and successes only by attempts that made no nested call
+    """
+    def __init__(self, exceptions:list[Exception]=[GatewayTimeout, ServiceUnavailable, TooManyRequestsError], wait_time:int=30, retry_limit:int=6, base_wait_time:float=1):
+        self.wait_time = wait_time # The longest backoff between attempts
+        self.base_wait_time = base_wait_time
         self.retry_limit = retry_limit
         self.exceptions = tuple(exceptions)
 
+    def get_wait_time(self, attempt_count:int, error:Exception) -> float:
+        backoff = random.uniform(0, min(self.wait_time, self.base_wait_time * (2 ** (attempt_count - 1))))
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+    @staticmethod
+    def _record_failure(circuit_breaker:CircuitBreaker, error:Exception) -> None:
+        # The error is re-raised through every wrapped call it was made from, but it's only one failed request
+        if getattr(error, "_circuit_breaker_recorded", False):
+            return None
+        circuit_breaker.record_failure()
+        try:
+            error._circuit_breaker_recorded = True
+        except AttributeError:
+            pass
+        return None
+
+    @staticmethod
+    def get_host(func:Callable, args:tuple) -> str:
+        url_base = getattr(args[0], "URL_BASE", "") if args else ""
+        if url_base:
+            return urlparse(url_base).netloc or url_base
+        return func.__module__
+
     def __call__(self, func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
         @functools.wraps(func)
         async def wrapper(*args: Any, **kwargs: Any) -> R:
+            host = self.get_host(func=func, args=args)
+            retry_budget = get_retry_budget(host=host)
+            circuit_breaker = get_circuit_breaker(host=host)
+            call = _RetriedCall(host=host, parent=_current_retried_call.get())
+            host_parent = call.get_host_parent()
+            attempt_count = 0
+
+            token = _current_retried_call.set(call)
             try:
-                return await func(*args, **kwargs)
-            except self.exceptions as e:
-                logger.debug(f"{e}")
-                attempt_count = 1
-                while attempt_count < self.retry_limit:
+                while True:
+                    if host_parent:
+                        host_parent.made_nested_call = True
+                    if not (call.is_within_trial() and circuit_breaker.trial_in_progress):
+                        call.is_trial = circuit_breaker.before_call()
+                    call.made_nested_call = False
+                    attempt_count += 1
                     try:
-                        logger.debug(f"Retrying in {self.wait_time}s")
-                        await asyncio.sleep(self.wait_time)
-                        return await func(*args, **kwargs)
+                        result = await func(*args, **kwargs)
                     except self.exceptions as e:
-                        logger.debug(f"Encountered '{e}', on attempt {attempt_count}")
-                        attempt_count += 1
-        return wrapper
\ No newline at end of file
+                        is_host_failure = isinstance(e, HOST_FAILURE_EXCEPTIONS)
+                        if is_host_failure:
+                            self._record_failure(circuit_breaker=circuit_breaker, error=e)
+                        else:
+                            circuit_breaker.record_success()
+                        if attempt_count >= self.retry_limit:
+                            logger.warning(f"Encountered '{e}' on the last of {self.retry_limit} attempts of {func.__name__}")
+                            raise e
+                        # Only retries of host failures are paid from the host's budget, other errors aren't a sign of an overloaded host
+                        if is_host_failure and not retry_budget.try_spend():
+                            logger.warning(f"Retry budget for '{host}' is exhausted, not retrying {func.__name__} after '{e}'")
+                            raise e
+                        wait_time = self.get_wait_time(attempt_count=attempt_count, error=e)
+                        logger.debug(f"Encountered '{e}' on attempt {attempt_count} of {func.__name__}, retrying in {wait_time:.1f}s")
+                        await asyncio.sleep(wait_time)
+                        continue
+                    except HOST_FAILURE_EXCEPTIONS as e:
+                        self._record_failure(circuit_breaker=circuit_breaker, error=e)
+                        raise e
+                    except CircuitOpenError as e:
+                        raise e
+                    except asyncio.CancelledError as e:
+                        raise e
+                    except Exception as e:
+                        # Any other error still came back from the host, so it isn't down
+                        circuit_breaker.record_success()
+                        raise e
+                    finally:
+                        if call.is_trial and circuit_breaker.trial_in_progress:
+                            circuit_breaker.end_trial()
+                        call.is_trial = False
+
+                    # Attempts that made nested calls had their requests recorded by those calls
+                    if not call.made_nested_call:
+                        circuit_breaker.record_success()
+                        retry_budget.record_success()
+                    return result
+            finally:
+                _current_retried_call.reset(token)
+        return wrapper
@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from loguru import logger
+import hashlib
+import sqlite3
+
+from booru_tools.shared import resources
+
+@dataclass(kw_only=True)
+class PostState:
+    origin:str # The plugin name the post was imported from
+    origin_id:str # The id of the post on the origin site
+    destination:str # The destination the post was pushed to
+    destination_id:int = field(default=None) # The id of the post on the destination
+    md5:str = field(default="")
+    sha1:str = field(default="")
+    updated_at:str = field(default="") # The origin updated_at value when the post was last pushed
+    tags_hash:str = field(default="") # The hash of the tag set that was last pushed
+
+    def matches(self, post:resources.InternalPost) -> bool:
+        """Checks if the post is unchanged since this state was recorded
+
+        Args:
+            post (resources.InternalPost): The post from the origin site
+
+        Returns:
+            bool: True if the origin updated_at and tag set both match
+        """
+        if self.updated_at != ImportStateDatabase.get_updated_at_string(post=post):
+            return False
+        if self.tags_hash != ImportStateDatabase.get_tags_hash(post=post):
+            return False
+        return True
+
+class ImportStateDatabase:
+    """A local SQLite store of what has already been imported into a destination, keyed by the origin post
+    """
+    def __init__(self, database_file:Path, destination:str):
+        self.database_file = Path(database_file)
+        self.destination = destination
+
+        logger.debug(f"Opening import state database '{self.database_file}' for destination '{self.destination}'")
+        self.connection = sqlite3.connect(self.database_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                destination TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                origin_id TEXT NOT NULL,
+                destination_id INTEGER,
+                md5 TEXT,
+                sha1 TEXT,
+                updated_at TEXT,
+                tags_hash TEXT,
+                PRIMARY KEY (destination, origin, origin_id)
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS url_cursors (
+                destination TEXT NOT NULL,
+                url TEXT NOT NULL,
+                newest_origin_id INTEGER,
+                PRIMARY KEY (destination, url)
+            )
+        """)
+        self.connection.commit()
+        return None
+
+    def get_newest_origin_id(self, url:str) -> int|None:
+        """Gets the newest origin post id seen when the url was last imported
+
+        Args:
+            url (str): The url that was imported
+
+        Returns:
+            int|None: The newest origin id, or None if the url hasn't been imported before
+        """
+        row = self.connection.execute(
+            "SELECT newest_origin_id FROM url_cursors WHERE destination = ? AND url = ?",
+            (self.destination, url)
+        ).fetchone()
+
+        if not row:
+            return None
+        return row["newest_origin_id"]
+
+    def save_newest_origin_id(self, url:str, newest_origin_id:int) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO url_cursors (destination, url, newest_origin_id) VALUES (?, ?, ?)",
+            (self.destination, url, newest_origin_id)
+        )
+        self.connection.commit()
+        return None
+
+    def get_post_state(self, post:resources.InternalPost) -> PostState|None:
+        row = self.connection.execute(
+            "SELECT * FROM posts WHERE destination = ? AND origin = ? AND origin_id = ?",
+            (self.destination, post.origin, str(post.id))
+        ).fetchone()
+
+        if not row:
+            return None
+        return PostState(**dict(row))
+
+    def save_post_state(self, post:resources.InternalPost, destination_post:resources.InternalPost) -> PostState:
+        """Records that the origin post has been pushed to the destination
+
+        Args:
+            post (resources.InternalPost): The post from the origin site
+            destination_post (resources.InternalPost): The post as it exists on the destination after the push
+
+        Returns:
+            PostState: The state that was saved
+        """
+        post_state = PostState(
+            origin=post.origin,
+            origin_id=str(post.id),
+            destination=self.destination,
+            destination_id=destination_post.id,
+            md5=destination_post.md5 or post.md5,
+            sha1=destination_post.sha1 or post.sha1,
+            updated_at=self.get_updated_at_string(post=post),
+            tags_hash=self.get_tags_hash(post=post)
+        )
+
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO posts (destination, origin, origin_id, destination_id, md5, sha1, updated_at, tags_hash)
+            VALUES (:destination, :origin, :origin_id, :destination_id, :md5, :sha1, :updated_at, :tags_hash)
+            """,
+            post_state.__dict__
+        )
+        return post_state
+
+    def commit(self) -> None:
+        self.connection.commit()
+        return None
+
+    def close(self) -> None:
+        logger.debug(f"Closing import state database '{self.database_file}'")
+        self.connection.commit()
+        self.connection.close()
+        return None
+
+    @staticmethod
+    def get_updated_at_string(post:resources.InternalPost) -> str:
+        if isinstance(post.updated_at, datetime):
+            return post.updated_at.isoformat()
+        if post.updated_at:
+            return str(post.updated_at)
+        return ""
+
+    @staticmethod
+    def get_tags_hash(post:resources.InternalPost) -> str:
+        tag_string = "\n".join(sorted(post.str_tags))
+        return hashlib.sha1(tag_string.encode()).hexdigest()
@@ -0,0 +1,118 @@
+from loguru import logger
+
+from booru_tools.shared import resources
+
+class PostFilter:
+    """Checks posts against blacklisted/required tags, allowed safety and a minimum score, compiled once into sets of tag names
+
+    Tags can be given as names, as AND-groups (a list of names, or names joined by 'and_seperator') or as InternalTags,
+    which match on any of their names or implications. A post is rejected if it contains any blacklisted tag or every tag
+    of a blacklisted AND-group, and required tags and AND-groups must all be on the post
+
+    The sets hold names rather than TagRegistry ids, as plugins and the tag graph also create tags outside the registry
+    and the registry gives one name several ids when it's seen with different categories or implications
+    """
+    def __init__(
+            self,
+            blacklisted_tags:list[str|list[str]|resources.InternalTag]=[],
+            required_tags:list[str|list[str]|resources.InternalTag]=[],
+            allowed_safety:list[str]=[],
+            minimum_score:int=0,
+            and_seperator:str="|"
+        ):
+        self.and_seperator = and_seperator
+        self.blacklisted_names:frozenset[str] = frozenset()
+        self.blacklisted_groups:tuple[frozenset[str], ...] = ()
+        self.required_names:frozenset[str] = frozenset()
+        self.allowed_safety:frozenset[str] = frozenset(allowed_safety or [])
+        self.minimum_score:int = minimum_score or 0
+
+        blacklisted_names:set[str] = set()
+        blacklisted_groups:list[frozenset[str]] = []
+        for tag in blacklisted_tags or []:
+            names = self._get_names(tag=tag)
+            if self._is_and_group(tag=tag) and len(names) > 1:
+                blacklisted_groups.append(names)
+            else:
+                blacklisted_names.update(names)
+        self.blacklisted_names = frozenset(blacklisted_names)
+        # Groups already covered by a single blacklisted name can never change the result
+        self.blacklisted_groups = tuple(group for group in blacklisted_groups if group.isdisjoint(self.blacklisted_names))
+
+        required_names:set[str] = set()
+        for tag in required_tags or []:
+            required_names.update(self._get_names(tag=tag))
+        self.required_names = frozenset(required_names)
+
+        logger.debug(f"Compiled {self}")
+
+    def __str__(self) -> str:
+        return (
+            f"post filter with {len(self.blacklisted_names)} blacklisted tags, {len(self.blacklisted_groups)} blacklisted tag groups, "
+            f"{len(self.required_names)} required tags, {len(self.allowed_safety) or 'any'} allowed safety and a minimum score of {self.minimum_score}"
+        )
+
+    def _is_and_group(self, tag:str|list[str]|resources.InternalTag) -> bool:
+        return isinstance(tag, list) or (isinstance(tag, str) and self.and_seperator in tag)
+
+    def _get_names(self, tag:str|list[str]|resources.InternalTag) -> frozenset[str]:
+        if isinstance(tag, resources.InternalTag):
+            return frozenset(tag.all_tag_strings())
+        if isinstance(tag, list):
+            return frozenset(name for name in tag if name)
+        return frozenset(name for name in tag.split(self.and_seperator) if name)
+
+    def is_allowed(self, post:resources.InternalPost) -> bool:
+        if post.deleted:
+            return False
+        if self.allowed_safety and post.safety not in self.allowed_safety:
+            return False
+        if self.minimum_score and post.score < self.minimum_score:
+            return False
+
+        tag_names = post.tag_names
+        if not self.blacklisted_names.isdisjoint(tag_names):
+            return False
+        for group in self.blacklisted_groups:
+            if group <= tag_names:
+                return False
+        return self.required_names <= tag_names
+
+    def get_rejection_reason(self, post:resources.InternalPost) -> str|None:
+        """Explains why the post isn't allowed, this is slower than is_allowed so it's only meant for logging
+
+        Args:
+            post (resources.InternalPost): The post to check
+
+        Returns:
+            str|None: Why the post was rejected, or None if it's allowed
+        """
+        if post.deleted:
+            return "is marked as deleted"
+        if self.allowed_safety and post.safety not in self.allowed_safety:
+            return f"has a safety of '{post.safety}' which isn't in the allowed safety selection"
+        if self.minimum_score and post.score < self.minimum_score:
+            return f"has a score of {post.score} which is below the minimum score of {self.minimum_score}"
+
+        tag_names = post.tag_names
+        if not self.blacklisted_names.isdisjoint(tag_names):
+            return f"contains blacklisted tags {sorted(self.blacklisted_names.intersection(tag_names))}"
+        for group in self.blacklisted_groups:
+            if group <= tag_names:
+                return f"contains all blacklisted tags from {sorted(group)}"
+        if not self.required_names <= tag_names:
+            return f"is missing required tags {sorted(self.required_names - tag_names)}"
+        return None
+
+    def filter_posts(self, posts:list[resources.InternalPost]) -> list[resources.InternalPost]:
+        """Filters out the posts that aren't allowed
+
+        Args:
+            posts (list[resources.InternalPost]): The posts to filter
+
+        Returns:
+            list[resources.InternalPost]: The allowed posts, in their original order
+        """
+        allowed_posts = [post for post in posts if self.is_allowed(post=post)]
+        logger.debug(f"Allowed {len(allowed_posts)} of {len(posts)} posts")
+        return allowed_posts
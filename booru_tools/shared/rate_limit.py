@@ -0,0 +1,248 @@
+from collections import deque
+from loguru import logger
+import aiohttp
+import asyncio
+import time
+
+OVERLOAD_STATUS_CODES = (429, 503, 504)
+
+class AdaptiveRateLimiter:
+    """Limits the rate and concurrency of requests, adjusting both with additive increase/multiplicative decrease
+
+    Every 'window_size' requests the limiter raises its rate and concurrency if they were all healthy,
+    and halves them (by 'decrease_factor') as soon as a request is overloaded (429/503/504 or a timeout)
+    or the window's p95 latency rises above 'latency_factor' times the baseline p95
+
+    Latency windows and baselines are kept per endpoint class, so slow calls aren't judged against fast ones.
+    The baseline is a moving average of the window p95s ('baseline_weight' per window), so it can rise again
+    when an endpoint gets slower for good
+    """
+    def __init__(
+            self,
+            name:str="",
+            initial_rate:float=3.0,
+            min_rate:float=0.1,
+            max_rate:float=50.0,
+            initial_concurrency:int=4,
+            min_concurrency:int=1,
+            max_concurrency:int=32,
+            additive_increase:float=0.5,
+            decrease_factor:float=0.5,
+            window_size:int=20,
+            latency_factor:float=2.0,
+            baseline_weight:float=0.2,
+            adaptive:bool=True
+        ):
+        self.name = name
+        self.rate = float(initial_rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.concurrency = int(initial_concurrency)
+        self.min_concurrency = int(min_concurrency)
+        self.max_concurrency = int(max_concurrency)
+        self.additive_increase = float(additive_increase)
+        self.decrease_factor = float(decrease_factor)
+        self.window_size = int(window_size)
+        self.latency_factor = float(latency_factor)
+        self.baseline_weight = float(baseline_weight)
+        self.adaptive = adaptive
+
+        self.in_flight:int = 0
+        self.baseline_p95s:dict[str, float] = {}
+        self._latencies:dict[str, deque[float]] = {}
+        self._next_send_time:float = 0.0
+        self._last_decrease_time:float = 0.0
+        self._condition = asyncio.Condition()
+
+    def __str__(self) -> str:
+        return f"{self.name} rate={self.rate:.2f}/s concurrency={self.in_flight}/{self.concurrency}"
+
+    @property
+    def current_rate(self) -> float:
+        return self.rate
+
+    def request(self, endpoint:str="") -> "LimitedRequest":
+        """Creates a context manager that waits for a request slot on entry, and records the outcome of the request on exit
+
+        Args:
+            endpoint (str, optional): The class of endpoint being called, whose latencies are compared with each other. Defaults to "".
+
+        Returns:
+            LimitedRequest: The context manager for a single request
+        """
+        return LimitedRequest(limiter=self, endpoint=endpoint)
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+
+        now = time.monotonic()
+        send_time = max(now, self._next_send_time)
+        self._next_send_time = send_time + (1 / self.rate)
+        if send_time > now:
+            try:
+                await asyncio.sleep(send_time - now)
+            except asyncio.CancelledError:
+                await self.release()
+                raise
+        return None
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+        return None
+
+    def record_success(self, latency:float, start_time:float, endpoint:str="") -> None:
+        if not self.adaptive:
+            return None
+
+        latencies = self._latencies.setdefault(endpoint, deque(maxlen=self.window_size))
+        latencies.append(latency)
+        if len(latencies) < self.window_size:
+            return None
+
+        window_p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1]
+        latencies.clear()
+
+        baseline_p95 = self.baseline_p95s.get(endpoint, None)
+        if baseline_p95 is None:
+            baseline_p95 = window_p95
+        self.baseline_p95s[endpoint] = baseline_p95 + (window_p95 - baseline_p95) * self.baseline_weight
+
+        if window_p95 > baseline_p95 * self.latency_factor and start_time >= self._last_decrease_time:
+            self._decrease(reason=f"'{endpoint}' p95 latency of {window_p95:.2f}s is over {self.latency_factor}x its baseline of {baseline_p95:.2f}s")
+            return None
+
+        self._increase()
+        return None
+
+    def record_overload(self, reason:str, start_time:float) -> None:
+        if not self.adaptive:
+            return None
+        # Requests sent before the last decrease were sent at the old rate, so they don't count towards another one
+        if start_time < self._last_decrease_time:
+            return None
+        for latencies in self._latencies.values():
+            latencies.clear()
+        self._decrease(reason=reason)
+        return None
+
+    def _increase(self) -> None:
+        previous_rate = self.rate
+        self.rate = min(self.max_rate, self.rate + self.additive_increase)
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        if self.rate != previous_rate:
+            logger.debug(f"Increased rate limit to {self}")
+        return None
+
+    def _decrease(self, reason:str) -> None:
+        self._last_decrease_time = time.monotonic()
+
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.concurrency = max(self.min_concurrency, int(self.concurrency * self.decrease_factor))
+        logger.info(f"Decreased rate limit to {self} as {reason}")
+        return None
+
+class LimitedRequest:
+    def __init__(self, limiter:AdaptiveRateLimiter, endpoint:str=""):
+        self.limiter = limiter
+        self.endpoint = endpoint
+        self.start_time:float = None
+
+    async def __aenter__(self) -> "LimitedRequest":
+        await self.limiter.acquire()
+        self.start_time = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        latency = time.monotonic() - self.start_time
+
+        if isinstance(exc_value, aiohttp.ClientResponseError) and exc_value.status in OVERLOAD_STATUS_CODES:
+            self.limiter.record_overload(reason=f"the server responded with {exc_value.status}", start_time=self.start_time)
+        elif isinstance(exc_value, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError)):
+            self.limiter.record_overload(reason=f"the request failed with '{exc_value.__class__.__name__}'", start_time=self.start_time)
+        elif exc_value is None or isinstance(exc_value, aiohttp.ClientResponseError):
+            self.limiter.record_success(latency=latency, start_time=self.start_time, endpoint=self.endpoint)
+
+        await self.limiter.release()
+        return False
+
+class UploadLane:
+    def __init__(self, bytes_per_second:float, max_uploads:int):
+        self.bytes_per_second = float(bytes_per_second)
+        self.max_uploads = int(max_uploads)
+        self._semaphore = asyncio.Semaphore(self.max_uploads)
+        self._next_send_time:float = 0.0
+
+    async def acquire(self, file_size:int) -> None:
+        await self._semaphore.acquire()
+
+        # Each upload reserves the time its bytes take at the lane's budget, so the next one starts once they're paid for
+        now = time.monotonic()
+        send_time = max(now, self._next_send_time)
+        self._next_send_time = send_time + (file_size / self.bytes_per_second)
+        if send_time > now:
+            try:
+                await asyncio.sleep(send_time - now)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+        return None
+
+    def release(self) -> None:
+        self._semaphore.release()
+        return None
+
+class UploadScheduler:
+    """Admits uploads before they're sent, charging each upload its size against a bytes per second budget
+
+    Files of 'heavy_threshold' bytes or more go through a separate heavy lane with its own budget and slots,
+    so small files keep flowing while a large file is being uploaded
+    """
+    def __init__(
+            self,
+            name:str="",
+            bytes_per_second:float=20_000_000,
+            max_uploads:int=4,
+            heavy_threshold:int=250_000_000,
+            heavy_bytes_per_second:float=10_000_000,
+            max_heavy_uploads:int=1
+        ):
+        self.name = name
+        self.heavy_threshold = int(heavy_threshold)
+        self.light_lane = UploadLane(bytes_per_second=bytes_per_second, max_uploads=max_uploads)
+        self.heavy_lane = UploadLane(bytes_per_second=heavy_bytes_per_second, max_uploads=max_heavy_uploads)
+
+    def __str__(self) -> str:
+        return f"{self.name} light={self.light_lane.bytes_per_second:.0f}B/s heavy={self.heavy_lane.bytes_per_second:.0f}B/s"
+
+    def get_lane(self, file_size:int) -> UploadLane:
+        if file_size >= self.heavy_threshold:
+            return self.heavy_lane
+        return self.light_lane
+
+    def upload(self, file_size:int) -> "AdmittedUpload":
+        """Creates a context manager that waits until the upload is admitted on entry, and frees its slot on exit
+
+        Args:
+            file_size (int): The size of the file being uploaded in bytes
+
+        Returns:
+            AdmittedUpload: The context manager for a single upload
+        """
+        return AdmittedUpload(lane=self.get_lane(file_size=file_size), file_size=file_size)
+
+class AdmittedUpload:
+    def __init__(self, lane:UploadLane, file_size:int):
+        self.lane = lane
+        self.file_size = file_size
+
+    async def __aenter__(self) -> "AdmittedUpload":
+        await self.lane.acquire(file_size=self.file_size)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        self.lane.release()
+        return False
@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import Any
 from pathlib import Path
 from collections import defaultdict
-from copy import deepcopy
+from copy import copy
 from urllib.parse import urlparse
 from loguru import logger
 import hashlib
@@ -14,14 +14,141 @@ from booru_tools.shared import constants
 # https://florimond.dev/en/posts/2018/10/reconciling-dataclasses-and-properties-in-python
 
 class UniqueList(list):
+    """A list that skips items it already contains, keeping the first occurrence in insertion order
+
+    Membership is checked against a count of the keys of the items, tags are keyed under all of their names
+    as they're equal to any tag sharing a name. The keys of each item are kept as a tuple from when it was added,
+    so rename a copy of a tag rather than a tag in the list. Unhashable items fall back to a linear check
+    """
+    def __init__(self, items=()):
+        super().__init__()
+        self._item_keys:list[tuple|None] = [] # The keys of the item at the same position
+        self._key_counts:dict = {}
+        self._unhashable_count:int = 0
+        self.extend(items)
+
+    @staticmethod
+    def _get_keys(item) -> tuple|None:
+        if getattr(item, "__hash__", None) is None:
+            return None
+        names = getattr(item, "names", None)
+        if isinstance(names, list):
+            return tuple(names)
+        return (item,)
+
+    def __contains__(self, item) -> bool:
+        keys = self._get_keys(item)
+        if keys is None or self._unhashable_count:
+            if keys is not None and any(key in self._key_counts for key in keys):
+                return True
+            return super().__contains__(item)
+        return any(key in self._key_counts for key in keys)
+
+    def _add_keys(self, keys:tuple|None) -> None:
+        if keys is None:
+            self._unhashable_count += 1
+            return None
+        for key in keys:
+            self._key_counts[key] = self._key_counts.get(key, 0) + 1
+        return None
+
+    def _remove_keys(self, keys:tuple|None) -> None:
+        if keys is None:
+            self._unhashable_count -= 1
+            return None
+        for key in keys:
+            key_count = self._key_counts[key] - 1
+            if key_count:
+                self._key_counts[key] = key_count
+            else:
+                del self._key_counts[key]
+        return None
+
+    def _rebuild_index(self) -> None:
+        self._item_keys = []
+        self._key_counts = {}
+        self._unhashable_count = 0
+        for item in self:
+            keys = self._get_keys(item)
+            self._item_keys.append(keys)
+            self._add_keys(keys)
+        return None
+
     def append(self, item):
-        if item not in self:
-            super().append(item)
+        if item in self:
+            return None
+        keys = self._get_keys(item)
+        super().append(item)
+        self._item_keys.append(keys)
+        self._add_keys(keys)
 
     def extend(self, items):
         for item in items:
             self.append(item)
 
+    def insert(self, index, item):
+        if item in self:
+            return None
+        keys = self._get_keys(item)
+        super().insert(index, item)
+        self._item_keys.insert(index, keys)
+        self._add_keys(keys)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __imul__(self, count):
+        super().__imul__(count)
+        self._rebuild_index()
+        return self
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        if isinstance(index, slice):
+            self._rebuild_index()
+            return None
+        keys = self._get_keys(value)
+        self._remove_keys(self._item_keys[index])
+        self._item_keys[index] = keys
+        self._add_keys(keys)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        if isinstance(index, slice):
+            self._rebuild_index()
+            return None
+        self._remove_keys(self._item_keys.pop(index))
+
+    def remove(self, item):
+        del self[self.index(item)]
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        self._remove_keys(self._item_keys.pop(index))
+        return item
+
+    def clear(self):
+        super().clear()
+        self._item_keys = []
+        self._key_counts = {}
+        self._unhashable_count = 0
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._rebuild_index()
+
+    def reverse(self):
+        super().reverse()
+        self._item_keys.reverse()
+
+    def copy(self) -> "UniqueList":
+        return self.__class__(self)
+
+    def __reduce__(self):
+        # Rebuilds the index when copied or pickled, rather than restoring a stale one
+        return (self.__class__, (list(self),))
+
 @dataclass(kw_only=True)
 class InternalPlugins:
     api:PluginBase = field(default=None) # This is the API plugin
@@ -78,8 +205,9 @@ class InternalResource:
         return filtered_data
         
     def merge_resource(self, update_object:"InternalResource", allow_blank_values:bool=False, merge_where_possible:bool=True, deep_copy:bool=True, fields_to_ignore:list[str]=[]) -> "InternalResource":
+        # With deep_copy the merge works on a copy whose containers are copied but whose values (such as interned tags) are shared
         if deep_copy:
-            resource = deepcopy(self)
+            resource = self._copy_for_merge()
         else:
             resource = self
 
@@ -103,9 +231,11 @@ class InternalResource:
             if merge_where_possible:
                 old_value = getattr(resource, field.name)
                 if isinstance(old_value, list):
+                    existing_values = UniqueList(old_value)
                     for value in new_value:
-                        if value in old_value:
+                        if value in existing_values:
                             continue
+                        existing_values.append(value)
                         old_value.append(value)
                     new_value = old_value
                 if isinstance(old_value, dict):
@@ -115,6 +245,23 @@ class InternalResource:
             
         return resource
     
+    def _copy_for_merge(self) -> "InternalResource":
+        resource = copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, (list, dict, set)):
+                resource.__dict__[name] = copy(value)
+            elif isinstance(value, InternalRelationship):
+                relations = copy(value)
+                relations.children = copy(value.children)
+                resource.__dict__[name] = relations
+
+        # Plugins write into _extra on the resources they're given, so the dicts in it are copied too
+        extra = default_extra()
+        for key, value in self._extra.items():
+            extra[key] = copy(value)
+        resource._extra = extra
+        return resource
+
     def diff(self, resource:"InternalResource", fields_to_ignore:list=[]) -> dict[str, Any]:
         diff = {}
         ignored_fields = self._default_diff_ignored_fields + fields_to_ignore
@@ -146,10 +293,15 @@ class InternalTag(InternalResource):
     names:list[str] # The list of names for this tag
     category:str = field(default=constants.TagCategory._DEFAULT) # The tag category string
     implications:list["InternalTag"] = field(default_factory=list) # A list of all tags this specific tag implies.
+    id:int = field(default=None) # The id of the tag in the tag registry, only set on interned tags
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, InternalTag):
-            return any(item in self.names for item in other.names)
+            if len(other.names) == 1:
+                return other.names[0] in self.names
+            return not set(self.names).isdisjoint(other.names)
         elif isinstance(other, str):
             return other in self.names
         raise NotImplementedError
@@ -161,7 +313,15 @@ class InternalTag(InternalResource):
         return f"InternalTag(name={self.names}, category={self.category}, implications={self.implications})"
     
     def __hash__(self):
-        return hash(f"{set(self.names)}/{self.category}/{set(self.implications)}")
+        # Tags are equal when they share any name, but only tags with the same primary name hash the same,
+        # so sets and dict keys only dedupe tags by their primary name. UniqueList dedupes on all names
+        if not self.names:
+            return 0
+        return hash(self.names[0])
+
+    @property
+    def _default_diff_ignored_fields(self):
+        return ["plugins", "metadata", "_extra", "origin", "deleted", "id"]
     
     def all_tag_strings(self) -> list[str]:
         tag_strings = set(self.names)
@@ -185,6 +345,91 @@ class InternalTag(InternalResource):
 
         return cls(**data)
 
+class TagRegistry:
+    """Interns tags so every post shares a single tag object for each name, category and set of implications
+
+    Each interned tag is given an integer id, and its implications are kept as a tuple of tag ids.
+    Interned tags are shared and never changed after they're created, so copy them (merge_resource does by default) before changing them
+    """
+    def __init__(self):
+        self._ids:dict[tuple[str, str, tuple[int, ...]], int] = {}
+        self._ids_by_name:dict[str, int] = {} # The tag an implication given only by its name resolves to
+        self._tags:list[InternalTag] = []
+        self._implication_ids:list[tuple[int, ...]] = []
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def get(self, name:str, category:str=constants.TagCategory._DEFAULT, implications:list[str|InternalTag]=[]) -> InternalTag:
+        """Gets the interned tag for the name, category and implications, creating it on first use
+
+        Args:
+            name (str): The name of the tag
+            category (str, optional): The category of the tag. Defaults to constants.TagCategory._DEFAULT.
+            implications (list[str|InternalTag], optional): The tags this tag implies, a name resolves to the interned tag
+                with that name, preferring one with a category. Defaults to [].
+
+        Returns:
+            InternalTag: The interned tag
+        """
+        implication_ids = self._get_implication_ids(name=name, implications=implications) if implications else ()
+        tag_id = self._ids.get((name, category, implication_ids), None)
+        if tag_id is not None:
+            return self._tags[tag_id]
+
+        tag_id = len(self._tags)
+        self._ids[(name, category, implication_ids)] = tag_id
+        self._tags.append(InternalTag(
+            names=[name],
+            category=category,
+            implications=[self._tags[implication_id] for implication_id in implication_ids],
+            id=tag_id
+        ))
+        self._implication_ids.append(implication_ids)
+
+        named_tag_id = self._ids_by_name.get(name, None)
+        if named_tag_id is None or (self._tags[named_tag_id].category == constants.TagCategory._DEFAULT and category != constants.TagCategory._DEFAULT):
+            self._ids_by_name[name] = tag_id
+        return self._tags[tag_id]
+
+    def get_by_id(self, tag_id:int) -> InternalTag:
+        return self._tags[tag_id]
+
+    def get_implication_ids(self, tag_id:int) -> tuple[int, ...]:
+        return self._implication_ids[tag_id]
+
+    def _get_implication_ids(self, name:str, implications:list[str|InternalTag]) -> tuple[int, ...]:
+        implication_ids:dict[int, None] = {}
+        for implication in implications:
+            if isinstance(implication, InternalTag):
+                if implication.id is not None and self._tags[implication.id] is implication:
+                    implication_id = implication.id
+                else:
+                    implication_id = self.get(name=implication.names[0], category=implication.category).id
+            else:
+                implication_id = self._ids_by_name.get(implication, None)
+                if implication_id is None:
+                    implication_id = self.get(name=implication).id
+
+            if self._tags[implication_id].names[0] != name:
+                implication_ids[implication_id] = None
+        return tuple(implication_ids)
+
+TAG_REGISTRY = TagRegistry()
+
+def get_tag(name:str, category:str=constants.TagCategory._DEFAULT, implications:list[str|InternalTag]=[]) -> InternalTag:
+    """Gets the shared tag for the name and category from the tag registry
+
+    Args:
+        name (str): The name of the tag
+        category (str, optional): The category of the tag. Defaults to constants.TagCategory._DEFAULT.
+        implications (list[str|InternalTag], optional): The tags this tag implies. Defaults to [].
+
+    Returns:
+        InternalTag: The shared tag
+    """
+    return TAG_REGISTRY.get(name=name, category=category, implications=implications)
+
 @dataclass(kw_only=True)
 class InternalRelationship:
     parent_id:int = None
@@ -231,13 +476,25 @@ class InternalPost(InternalResource):
     def _default_diff_ignored_fields(self):
         return ["plugins", "metadata", "_extra", "relations", "score", "md5", "sha1", "local_file", "origin", "deleted", "_sources"]
 
+    @property
+    def tag_names(self) -> frozenset[str]:
+        """The names of all of the post's tags, built on each call as tags can be renamed in place
+
+        Returns:
+            frozenset[str]: The tag names
+        """
+        tag_names = set()
+        for tag in self.tags:
+            tag_names.update(tag.names)
+        return frozenset(tag_names)
+
     @property
     def sources(self) -> list[str]:
         return self._sources
 
     @sources.setter
     def sources(self, sources:list) -> None:
-        self._sources = UniqueList(set(sources))
+        self._sources = UniqueList(sources)
 
     def sources_of_type(self, desired_source_type:str) -> list[str]:
         found_sources = []
@@ -277,7 +534,7 @@ class InternalPost(InternalResource):
         return found_sources
     
     def contains_any_tags(self, tags:list[str|InternalTag]) -> bool:
-        post_tags = set(self.str_tags)
+        post_tags = self.tag_names
         for tag in tags:
             if isinstance(tag, str):
                 if tag in post_tags:
@@ -299,7 +556,7 @@ class InternalPost(InternalResource):
         if not tags:
             return True
         
-        post_tags = set(self.str_tags)
+        post_tags = self.tag_names
         all_tags = set()
 
         for tag in tags:
@@ -321,11 +578,7 @@ class InternalPost(InternalResource):
     
     @property
     def str_tags(self) -> list[str]:
-        tag_strings = set()
-        for tag in self.tags:
-            names = set(tag.names)
-            tag_strings.update(names)
-        return list(tag_strings)
+        return list(self.tag_names)
     
     @classmethod
     def from_dict(cls, data:dict) -> "InternalPost":
@@ -0,0 +1,136 @@
+from loguru import logger
+import gc
+
+from booru_tools.shared import resources
+
+class TagGraphBuilder:
+    """Builds a tag graph from flat tag, alias and implication records, using integer tag ids throughout
+
+    Aliased tags are grouped with union-find and implications are stored as adjacency lists of tag ids,
+    InternalTags are only created once the whole graph has been built
+    """
+    def __init__(self):
+        self.names:list[str] = []
+        self.categories:list[str|None] = [] # None marks a name that's only known as an alias
+        self.ids_by_name:dict[str, int] = {}
+        self.implications:list[list[int]] = []
+
+        self._parents:list[int] = []
+        self._group_sizes:list[int] = []
+        self._canonical_ids:list[int] = [] # The tag whose name and category each group root represents
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add_tag(self, name:str, category:str) -> int:
+        if (tag_id := self.ids_by_name.get(name, None)) is not None:
+            return tag_id
+        return self._add_name(name=name, category=category)
+
+    def add_alias(self, name:str, alias:str) -> None:
+        """Adds an alias to a tag, merging the two tags if the alias is a tag of its own
+
+        Args:
+            name (str): The name of the tag the alias points to
+            alias (str): The alias name
+        """
+        tag_id = self.ids_by_name.get(name, None)
+        if tag_id is None:
+            logger.debug(f"Skipping alias '{alias}' as the tag '{name}' didn't exist")
+            return None
+
+        alias_id = self.ids_by_name.get(alias, None)
+        if alias_id is None:
+            alias_id = self._add_name(name=alias, category=None)
+        self._union(from_id=alias_id, to_id=tag_id)
+        return None
+
+    def add_implication(self, name:str, implication:str) -> None:
+        tag_id = self.ids_by_name.get(name, None)
+        implication_id = self.ids_by_name.get(implication, None)
+        if tag_id is None or implication_id is None:
+            logger.debug(f"Skipping implication '{implication}' as the tag '{name}' or '{implication}' didn't exist")
+            return None
+        self.implications[tag_id].append(implication_id)
+        return None
+
+    def is_tag(self, name:str) -> bool:
+        tag_id = self.ids_by_name.get(name, None)
+        return tag_id is not None and self.categories[tag_id] is not None
+
+    def build(self) -> list[resources.InternalTag]:
+        """Creates an InternalTag for every alias group, with the implications of all tags in the group
+
+        Returns:
+            list[resources.InternalTag]: The tags in the graph
+        """
+        # Creating hundreds of thousands of tags would otherwise trigger repeated garbage collection passes over them
+        gc.disable()
+        try:
+            return self._build()
+        finally:
+            gc.enable()
+
+    def _build(self) -> list[resources.InternalTag]:
+        member_ids:dict[int, list[int]] = {}
+        for tag_id in range(len(self.names)):
+            member_ids.setdefault(self._find(tag_id=tag_id), []).append(tag_id)
+
+        tags:dict[int, resources.InternalTag] = {}
+        for root_id, group_member_ids in member_ids.items():
+            canonical_id = self._canonical_ids[root_id]
+            if self.categories[canonical_id] is None:
+                continue
+            names = [self.names[canonical_id]]
+            names.extend(self.names[member_id] for member_id in group_member_ids if member_id != canonical_id)
+            tags[root_id] = resources.InternalTag(
+                names=names,
+                category=self.categories[canonical_id]
+            )
+
+        for root_id, group_member_ids in member_ids.items():
+            if root_id not in tags:
+                continue
+            implied_root_ids:dict[int, None] = {}
+            for member_id in group_member_ids:
+                for implication_id in self.implications[member_id]:
+                    implied_root_ids[self._find(tag_id=implication_id)] = None
+            implied_root_ids.pop(root_id, None)
+            tags[root_id].implications = [tags[implied_root_id] for implied_root_id in implied_root_ids if implied_root_id in tags]
+
+        logger.debug(f"Built {len(tags)} tags from {len(self.names)} tag names")
+        return list(tags.values())
+
+    def _add_name(self, name:str, category:str|None) -> int:
+        tag_id = len(self.names)
+        self.names.append(name)
+        self.categories.append(category)
+        self.ids_by_name[name] = tag_id
+        self.implications.append([])
+        self._parents.append(tag_id)
+        self._group_sizes.append(1)
+        self._canonical_ids.append(tag_id)
+        return tag_id
+
+    def _find(self, tag_id:int) -> int:
+        root_id = tag_id
+        while self._parents[root_id] != root_id:
+            root_id = self._parents[root_id]
+        while self._parents[tag_id] != root_id:
+            self._parents[tag_id], tag_id = root_id, self._parents[tag_id]
+        return root_id
+
+    def _union(self, from_id:int, to_id:int) -> None:
+        from_root_id = self._find(tag_id=from_id)
+        to_root_id = self._find(tag_id=to_id)
+        if from_root_id == to_root_id:
+            return None
+
+        # The group keeps the name of the tag being aliased to, whichever root ends up on top
+        canonical_id = self._canonical_ids[to_root_id]
+        if self._group_sizes[from_root_id] > self._group_sizes[to_root_id]:
+            from_root_id, to_root_id = to_root_id, from_root_id
+        self._parents[from_root_id] = to_root_id
+        self._group_sizes[to_root_id] += self._group_sizes[from_root_id]
+        self._canonical_ids[to_root_id] = canonical_id
+        return None
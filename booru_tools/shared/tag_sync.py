@@ -0,0 +1,189 @@
+from dataclasses import dataclass, field
+from collections import Counter
+from copy import copy
+from typing import Literal
+from loguru import logger
+
+from booru_tools.shared import resources
+
+MAX_TAG_NAMES = 189 # szurubooru returns a 500 error if tag names exceed 190 names
+
+@dataclass(kw_only=True)
+class TagOperation:
+    action:Literal["create", "update", "merge", "delete"]
+    tag:resources.InternalTag # The tag to create/update/delete, or the tag to merge away
+    target:resources.InternalTag = field(default=None) # The tag being merged into
+
+    def __str__(self) -> str:
+        if self.target:
+            return f"{self.action} '{self.tag}' into '{self.target}'"
+        return f"{self.action} '{self.tag}'"
+
+@dataclass(kw_only=True)
+class TagSyncStep:
+    source_tag:resources.InternalTag
+    operations:list[TagOperation] = field(default_factory=list)
+
+@dataclass(kw_only=True)
+class TagSyncPlan:
+    steps:list[TagSyncStep] = field(default_factory=list) # Steps that only touch tags no earlier step touched, safe to run concurrently
+    live_tags:list[resources.InternalTag] = field(default_factory=list) # Tags overlapping an earlier step, to be pushed with live conflict checks afterwards
+    unchanged_count:int = field(default=0)
+
+    @property
+    def operation_counts(self) -> Counter:
+        return Counter(operation.action for step in self.steps for operation in step.operations)
+
+    def __str__(self) -> str:
+        counts = ", ".join(f"{count} {action}" for action, count in sorted(self.operation_counts.items()))
+        return f"{len(self.steps)} steps ({counts or 'no operations'}), {len(self.live_tags)} live tags and {self.unchanged_count} unchanged tags"
+
+class TagSyncPlanner:
+    """Plans the tag operations needed to make a destination match a source tag graph, without making any requests
+
+    The plan mirrors what push_tag would do for each tag, create the tag when no destination tag shares a name with it,
+    otherwise delete unused conflicting tags, merge used conflicting tags into the first one and update it if it differs
+    """
+    def __init__(self, destination_tags:list[resources.InternalTag], destination:str):
+        self.destination = destination
+        self.tags_by_name:dict[str, resources.InternalTag] = {}
+        self.touched_tags:set[int] = set()
+
+        for tag in destination_tags:
+            self._index_tag(tag=tag)
+
+    def plan(self, tags:list[resources.InternalTag]) -> TagSyncPlan:
+        tag_sync_plan = TagSyncPlan()
+
+        for tag in tags:
+            if len(tag.names) > MAX_TAG_NAMES:
+                # The tag may be interned and shared with other posts, so only its copy is truncated
+                tag = copy(tag)
+                tag.names = tag.names[:MAX_TAG_NAMES]
+            conflicting_tags = self._find_conflicting_tags(names=tag.names)
+
+            if any(id(conflicting_tag) in self.touched_tags for conflicting_tag in conflicting_tags):
+                tag_sync_plan.live_tags.append(tag)
+                continue
+
+            step = self._plan_tag(tag=tag, conflicting_tags=conflicting_tags)
+            if not step.operations:
+                tag_sync_plan.unchanged_count += 1
+                continue
+            tag_sync_plan.steps.append(step)
+
+        logger.info(f"Planned {tag_sync_plan}")
+        return tag_sync_plan
+
+    def _plan_tag(self, tag:resources.InternalTag, conflicting_tags:list[resources.InternalTag]) -> TagSyncStep:
+        step = TagSyncStep(source_tag=tag)
+
+        if not conflicting_tags:
+            step.operations.append(TagOperation(action="create", tag=tag))
+            self._touch_tag(tag=tag)
+            return step
+
+        primary_tag = conflicting_tags[0]
+        if not tag.diff(resource=primary_tag):
+            return step
+
+        for conflicting_tag in conflicting_tags[1:]:
+            self._remove_tag(tag=conflicting_tag)
+            if self._get_usages(tag=conflicting_tag) == 0:
+                step.operations.append(TagOperation(action="delete", tag=conflicting_tag))
+                continue
+            step.operations.append(TagOperation(action="merge", tag=conflicting_tag, target=primary_tag))
+
+        desired_tag:resources.InternalTag = primary_tag.merge_resource(update_object=tag)
+        desired_tag.names = desired_tag.names[:MAX_TAG_NAMES]
+
+        if desired_tag.diff(resource=primary_tag):
+            step.operations.append(TagOperation(action="update", tag=desired_tag))
+
+        self._remove_tag(tag=primary_tag)
+        self._touch_tag(tag=desired_tag)
+        return step
+
+    def _find_conflicting_tags(self, names:list[str]) -> list[resources.InternalTag]:
+        conflicting_tags:dict[int, resources.InternalTag] = {}
+        for name in names:
+            if found_tag := self.tags_by_name.get(name.lower(), None):
+                conflicting_tags.setdefault(id(found_tag), found_tag)
+        return list(conflicting_tags.values())
+
+    def _get_usages(self, tag:resources.InternalTag) -> int|None:
+        # Tags without a known usage count are treated as used, so they're merged rather than deleted
+        return tag._extra[self.destination].get("usages", None)
+
+    def _index_tag(self, tag:resources.InternalTag) -> None:
+        for name in tag.names:
+            self.tags_by_name[name.lower()] = tag
+        return None
+
+    def _touch_tag(self, tag:resources.InternalTag) -> None:
+        self._index_tag(tag=tag)
+        self.touched_tags.add(id(tag))
+        return None
+
+    def _remove_tag(self, tag:resources.InternalTag) -> None:
+        for name in tag.names:
+            if self.tags_by_name.get(name.lower(), None) is tag:
+                del self.tags_by_name[name.lower()]
+        return None
+
+def get_implication_layers(tags:list[resources.InternalTag]) -> tuple[list[list[int]], list[int]]:
+    """Orders the tags into layers where every tag only implies tags from earlier layers, so implied tags exist before the tags implying them
+
+    Implications on tags outside of the provided tags are ignored. When only tags in an implication cycle remain,
+    the tag with the fewest unmet implications is placed in its own layer to break the cycle
+
+    Args:
+        tags (list[resources.InternalTag]): The tags to order
+
+    Returns:
+        tuple[list[list[int]], list[int]]: The layers of tag indexes, and the indexes of the tags that were used to break cycles
+    """
+    index_by_name:dict[str, int] = {}
+    for index, tag in enumerate(tags):
+        for name in tag.names:
+            index_by_name.setdefault(name.lower(), index)
+
+    dependents:list[list[int]] = [[] for _ in tags]
+    unmet_implication_counts:list[int] = [0] * len(tags)
+    for index, tag in enumerate(tags):
+        implied_indexes:set[int] = set()
+        for implication in tag.implications:
+            for name in implication.names:
+                implied_index = index_by_name.get(name.lower(), None)
+                if implied_index is not None and implied_index != index:
+                    implied_indexes.add(implied_index)
+        for implied_index in implied_indexes:
+            dependents[implied_index].append(index)
+        unmet_implication_counts[index] = len(implied_indexes)
+
+    layers:list[list[int]] = []
+    cycle_breaks:list[int] = []
+    placed:list[bool] = [False] * len(tags)
+    placed_count = 0
+    layer = [index for index, count in enumerate(unmet_implication_counts) if count == 0]
+
+    while placed_count < len(tags):
+        if not layer:
+            unplaced_indexes = (index for index, is_placed in enumerate(placed) if not is_placed)
+            cycle_break = min(unplaced_indexes, key=lambda index: unmet_implication_counts[index])
+            logger.warning(f"Breaking implication cycle at tag '{tags[cycle_break]}' with {unmet_implication_counts[cycle_break]} unmet implications")
+            cycle_breaks.append(cycle_break)
+            layer = [cycle_break]
+
+        next_layer:list[int] = []
+        for index in layer:
+            placed[index] = True
+            for dependent in dependents[index]:
+                unmet_implication_counts[dependent] -= 1
+                if unmet_implication_counts[dependent] == 0 and not placed[dependent]:
+                    next_layer.append(dependent)
+        placed_count += len(layer)
+        layers.append(layer)
+        layer = next_layer
+
+    return layers, cycle_breaks
@@ -0,0 +1,103 @@
+import asyncio
+import time
+import pytest
+
+from booru_tools.shared import errors
+
+HOST = "booru.test"
+
+class Api:
+    URL_BASE = f"https://{HOST}"
+
+    def __init__(self, failures:int=0, exception:type[Exception]=errors.ServiceUnavailable):
+        self.failures = failures
+        self.exception = exception
+        self.call_count = 0
+
+    @errors.RetryOnExceptions(exceptions=[errors.ServiceUnavailable, ValueError], retry_limit=10, base_wait_time=0)
+    async def request(self) -> str:
+        self.call_count += 1
+        if self.call_count <= self.failures:
+            raise self.exception("failed")
+        return "ok"
+
+class NestedApi(Api):
+    @errors.RetryOnExceptions(exceptions=[errors.ServiceUnavailable], retry_limit=1, base_wait_time=0)
+    async def outer_request(self) -> str:
+        return await self.request()
+
+@pytest.fixture(autouse=True)
+def reset_hosts():
+    errors._retry_budgets.clear()
+    errors._circuit_breakers.clear()
+    yield
+    errors._retry_budgets.clear()
+    errors._circuit_breakers.clear()
+
+def test_retries_until_success_and_spends_budget():
+    api = Api(failures=2)
+    assert asyncio.run(api.request()) == "ok"
+    assert api.call_count == 3
+    assert errors.get_retry_budget(HOST).tokens == pytest.approx(20 - 2 + 0.1)
+    assert errors.get_circuit_breaker(HOST).failure_count == 0
+
+def test_non_host_failures_are_retried_without_spending_budget():
+    api = Api(failures=2, exception=ValueError)
+    assert asyncio.run(api.request()) == "ok"
+    assert errors.get_retry_budget(HOST).tokens == 20
+
+def test_exhausted_budget_stops_retrying():
+    errors.get_retry_budget(HOST).tokens = 1
+    api = Api(failures=100)
+    with pytest.raises(errors.ServiceUnavailable):
+        asyncio.run(api.request())
+    assert api.call_count == 2
+
+def test_circuit_opens_and_fails_fast():
+    api = Api(failures=100)
+    # The retry after the failure that opens the circuit isn't let through
+    with pytest.raises(errors.CircuitOpenError):
+        asyncio.run(api.request())
+    circuit_breaker = errors.get_circuit_breaker(HOST)
+    assert circuit_breaker.is_open
+    assert api.call_count == circuit_breaker.failure_threshold
+
+    with pytest.raises(errors.CircuitOpenError):
+        asyncio.run(api.request())
+    assert api.call_count == circuit_breaker.failure_threshold
+
+def test_trial_call_closes_circuit():
+    api = Api(failures=5)
+    with pytest.raises(errors.CircuitOpenError):
+        asyncio.run(api.request())
+    circuit_breaker = errors.get_circuit_breaker(HOST)
+    circuit_breaker.opened_at = time.monotonic() - circuit_breaker.reset_timeout
+
+    assert asyncio.run(api.request()) == "ok"
+    assert not circuit_breaker.is_open
+    assert not circuit_breaker.trial_in_progress
+
+def test_nested_calls_record_each_failure_once():
+    api = NestedApi(failures=3)
+    assert asyncio.run(api.outer_request()) == "ok"
+    assert api.call_count == 4
+    assert errors.get_circuit_breaker(HOST).failure_count == 0
+    assert errors.get_retry_budget(HOST).tokens == pytest.approx(20 - 3 + 0.1)
+
+def test_nested_calls_go_through_open_circuit():
+    api = NestedApi(failures=100)
+    with pytest.raises(errors.CircuitOpenError):
+        asyncio.run(api.outer_request())
+    circuit_breaker = errors.get_circuit_breaker(HOST)
+    assert circuit_breaker.failure_count == circuit_breaker.failure_threshold
+    assert api.call_count == circuit_breaker.failure_threshold
+
+    with pytest.raises(errors.CircuitOpenError):
+        asyncio.run(api.outer_request())
+    assert api.call_count == circuit_breaker.failure_threshold
+
+def test_parse_retry_after():
+    assert errors.parse_retry_after("5") == 5
+    assert errors.parse_retry_after("-5") == 0
+    assert errors.parse_retry_after("not a date") is None
+    assert errors.parse_retry_after(None) is None
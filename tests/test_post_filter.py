@@ -0,0 +1,49 @@
+from booru_tools.shared import resources, post_filter
+
+def create_post(tags:list[str|resources.InternalTag], safety:str="safe", score:int=0, deleted:bool=False) -> resources.InternalPost:
+    post_tags = [tag if isinstance(tag, resources.InternalTag) else resources.InternalTag(names=[tag]) for tag in tags]
+    return resources.InternalPost(id=1, sources=[], tags=post_tags, safety=safety, score=score, deleted=deleted)
+
+def test_blacklisted_tags_and_groups():
+    filter = post_filter.PostFilter(blacklisted_tags=["gore", "cat|dog", ["red", "blue"], "gore|cat"])
+    assert filter.blacklisted_names == {"gore"}
+    assert filter.blacklisted_groups == (frozenset({"cat", "dog"}), frozenset({"red", "blue"}))
+
+    assert not filter.is_allowed(create_post(tags=["gore"]))
+    assert not filter.is_allowed(create_post(tags=["cat", "dog", "tree"]))
+    assert not filter.is_allowed(create_post(tags=["red", "blue"]))
+    assert filter.is_allowed(create_post(tags=["cat", "red"]))
+
+def test_blacklisted_internal_tag_matches_its_implications():
+    animal = resources.InternalTag(names=["animal"])
+    filter = post_filter.PostFilter(blacklisted_tags=[resources.InternalTag(names=["cat", "kitty"], implications=[animal])])
+    assert filter.blacklisted_names == {"cat", "kitty", "animal"}
+    assert not filter.is_allowed(create_post(tags=["kitty"]))
+    assert not filter.is_allowed(create_post(tags=[resources.InternalTag(names=["dog", "animal"])]))
+    assert filter.is_allowed(create_post(tags=["dog"]))
+
+def test_required_tags():
+    filter = post_filter.PostFilter(required_tags=["cat", "tree|grass"])
+    assert filter.is_allowed(create_post(tags=["cat", "tree", "grass"]))
+    assert not filter.is_allowed(create_post(tags=["cat", "tree"]))
+    assert filter.get_rejection_reason(create_post(tags=["cat", "tree"])) == "is missing required tags ['grass']"
+
+def test_safety_score_and_deleted():
+    filter = post_filter.PostFilter(allowed_safety=["safe"], minimum_score=5)
+    assert filter.is_allowed(create_post(tags=[], score=5))
+    assert not filter.is_allowed(create_post(tags=[], score=4))
+    assert not filter.is_allowed(create_post(tags=[], safety="unsafe", score=5))
+    assert not filter.is_allowed(create_post(tags=[], score=5, deleted=True))
+
+def test_rejection_reason_matches_is_allowed():
+    filter = post_filter.PostFilter(blacklisted_tags=["gore", "cat|dog"], required_tags=["tree"], minimum_score=1)
+    posts = [
+        create_post(tags=["tree"], score=1),
+        create_post(tags=["tree", "gore"], score=1),
+        create_post(tags=["tree", "cat", "dog"], score=1),
+        create_post(tags=["cat"], score=1),
+        create_post(tags=["tree"], score=0)
+    ]
+    for post in posts:
+        assert filter.is_allowed(post) == (filter.get_rejection_reason(post) is None)
+    assert filter.filter_posts(posts) == [posts[0]]
@@ -0,0 +1,40 @@
+from booru_tools.shared import resources
+
+def create_post() -> resources.InternalPost:
+    tag = resources.InternalTag(names=["cat"])
+    post = resources.InternalPost(id=1, sources=["https://booru.test/1"], tags=[tag], relations=resources.InternalRelationship(children=[2]))
+    post._extra["plugin"]["key"] = "value"
+    return post
+
+def test_copy_for_merge_copies_containers():
+    post = create_post()
+    post_copy = post._copy_for_merge()
+
+    post_copy.tags.append(resources.InternalTag(names=["dog"]))
+    post_copy.sources.append("https://booru.test/2")
+    post_copy.relations.children.append(3)
+    post_copy.relations.parent_id = 4
+    post_copy._extra["plugin"]["key"] = "changed"
+    post_copy._extra["other"]["key"] = "value"
+
+    assert [tag.names for tag in post.tags] == [["cat"]]
+    assert post.sources == ["https://booru.test/1"]
+    assert post.relations.children == [2]
+    assert post.relations.parent_id is None
+    assert post._extra == {"plugin": {"key": "value"}}
+
+def test_copy_for_merge_shares_values():
+    post = create_post()
+    post_copy = post._copy_for_merge()
+    assert post_copy.tags[0] is post.tags[0]
+    assert post_copy.diff(post) == {}
+
+def test_merge_resource_leaves_original_unchanged():
+    post = create_post()
+    update = resources.InternalPost(id=1, sources=["https://booru.test/2"], tags=[resources.InternalTag(names=["dog"])])
+    merged = post.merge_resource(update_object=update)
+
+    assert [tag.names[0] for tag in merged.tags] == ["cat", "dog"]
+    assert list(merged.sources) == ["https://booru.test/1", "https://booru.test/2"]
+    assert [tag.names[0] for tag in post.tags] == ["cat"]
+    assert list(post.sources) == ["https://booru.test/1"]
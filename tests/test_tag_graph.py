@@ -0,0 +1,55 @@
+from booru_tools.shared import tag_graph
+
+def get_tags_by_name(builder:tag_graph.TagGraphBuilder) -> dict:
+    return {tag.names[0]: tag for tag in builder.build()}
+
+def test_add_tag_returns_existing_id():
+    builder = tag_graph.TagGraphBuilder()
+    tag_id = builder.add_tag(name="cat", category="general")
+    assert builder.add_tag(name="cat", category="species") == tag_id
+    assert len(builder) == 1
+    assert builder.is_tag("cat")
+
+def test_aliases_are_grouped_under_the_aliased_tag():
+    builder = tag_graph.TagGraphBuilder()
+    builder.add_tag(name="cat", category="species")
+    builder.add_tag(name="kitty", category="general")
+    builder.add_alias(name="cat", alias="kitty")
+    builder.add_alias(name="cat", alias="feline")
+    builder.add_alias(name="missing", alias="nothing")
+
+    tags = get_tags_by_name(builder=builder)
+    assert list(tags) == ["cat"]
+    assert tags["cat"].names == ["cat", "kitty", "feline"]
+    assert tags["cat"].category == "species"
+    assert not builder.is_tag("feline")
+    assert not builder.is_tag("nothing")
+
+def test_alias_keeps_target_name_whichever_group_is_larger():
+    builder = tag_graph.TagGraphBuilder()
+    builder.add_tag(name="big", category="general")
+    builder.add_alias(name="big", alias="large")
+    builder.add_alias(name="big", alias="huge")
+    builder.add_tag(name="giant", category="meta")
+    builder.add_alias(name="giant", alias="big")
+
+    tags = get_tags_by_name(builder=builder)
+    assert list(tags) == ["giant"]
+    assert tags["giant"].category == "meta"
+    assert set(tags["giant"].names) == {"giant", "big", "large", "huge"}
+
+def test_implications_of_aliases_are_merged_and_deduplicated():
+    builder = tag_graph.TagGraphBuilder()
+    for name in ["cat", "kitty", "animal", "mammal"]:
+        builder.add_tag(name=name, category="general")
+    builder.add_implication(name="cat", implication="animal")
+    builder.add_implication(name="kitty", implication="animal")
+    builder.add_implication(name="kitty", implication="mammal")
+    builder.add_implication(name="kitty", implication="cat")
+    builder.add_implication(name="cat", implication="missing")
+    builder.add_alias(name="cat", alias="kitty")
+
+    tags = get_tags_by_name(builder=builder)
+    assert set(tags) == {"cat", "animal", "mammal"}
+    assert [tag.names[0] for tag in tags["cat"].implications] == ["animal", "mammal"]
+    assert tags["cat"].implications[0] is tags["animal"]
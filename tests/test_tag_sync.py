@@ -0,0 +1,35 @@
+from booru_tools.shared import resources, tag_sync
+
+def create_tags(implications:dict[str, list[str]]) -> list[resources.InternalTag]:
+    tags = {name: resources.InternalTag(names=[name]) for name in implications}
+    for name, implied_names in implications.items():
+        tags[name].implications = [tags.get(implied_name) or resources.InternalTag(names=[implied_name]) for implied_name in implied_names]
+    return list(tags.values())
+
+def get_layer_names(tags:list[resources.InternalTag], layers:list[list[int]]) -> list[set[str]]:
+    return [{tags[index].names[0] for index in layer} for layer in layers]
+
+def test_implied_tags_are_placed_first():
+    tags = create_tags({"cat": ["animal", "feline"], "feline": ["animal"], "animal": [], "dog": ["animal"]})
+    layers, cycle_breaks = tag_sync.get_implication_layers(tags=tags)
+    assert get_layer_names(tags=tags, layers=layers) == [{"animal"}, {"feline", "dog"}, {"cat"}]
+    assert cycle_breaks == []
+
+def test_implications_outside_the_tags_are_ignored():
+    tags = create_tags({"cat": ["animal"]})
+    layers, cycle_breaks = tag_sync.get_implication_layers(tags=tags)
+    assert layers == [[0]]
+    assert cycle_breaks == []
+
+def test_cycles_are_broken_at_the_tag_with_fewest_unmet_implications():
+    tags = create_tags({"a": ["b"], "b": ["c"], "c": ["a", "d"], "d": [], "e": ["a"]})
+    layers, cycle_breaks = tag_sync.get_implication_layers(tags=tags)
+    assert [tags[index].names[0] for index in cycle_breaks] == ["a"]
+    assert get_layer_names(tags=tags, layers=layers) == [{"d"}, {"a"}, {"c", "e"}, {"b"}]
+
+def test_every_tag_is_placed_once():
+    tags = create_tags({"a": ["b"], "b": ["a"], "c": ["d"], "d": ["c"], "e": ["e"]})
+    layers, cycle_breaks = tag_sync.get_implication_layers(tags=tags)
+    placed_indexes = [index for layer in layers for index in layer]
+    assert sorted(placed_indexes) == list(range(len(tags)))
+    assert len(cycle_breaks) == 2